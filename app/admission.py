@@ -0,0 +1,201 @@
+"""admission.py - rate limits and a concurrency cap for the public write endpoints
+
+POST /responses/ and POST /progress/ need no token, so anything on the
+internet can call them in a loop. Each client gets a token bucket per endpoint
+and is refused with 429 once it runs dry. Clients are told apart by the peer
+address, or by the X-Real-IP header nginx sets when the peer is one of the
+trusted proxies; from anyone else the header could be forged. All of them together share a cap on concurrent write handlers: progress
+events may only use the unreserved part of it and are refused with 503 at
+once when it is full, while RSVPs may wait briefly for a slot, so a flood of
+progress events can't starve RSVPs of the single SQLite writer.
+
+The limits are per process; with several workers each one enforces them.
+"""
+
+import asyncio
+import ipaddress
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from collections.abc import AsyncGenerator, Callable
+
+from fastapi import HTTPException, Request
+
+from .metrics import requests_shed
+
+
+class RateLimiter:
+    """Token bucket per client refilling at `rate` per second up to `burst`"""
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def acquire(self, client: str) -> float:
+        """Take a token; returns 0 when allowed, else seconds until one refills"""
+
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / self.rate
+
+            self._buckets[client] = (tokens, now)
+            self._buckets.move_to_end(client)
+            # A forgotten client starts again with a full bucket, so only the
+            # least recently seen ones are dropped.
+            while len(self._buckets) > self.max_clients:
+                _ = self._buckets.popitem(last=False)
+            return wait
+
+
+class WriteGate:
+    """Caps concurrent write handlers, keeping `reserved` slots for priority ones
+
+    Ordinary requests are admitted while fewer than limit - reserved writes
+    run and refused otherwise. Priority requests may use every slot and wait
+    up to `wait` seconds, first come first served, for one to free up.
+    """
+
+    def __init__(self, limit: int, reserved: int, wait: float):
+        self.limit = limit
+        self.reserved = min(reserved, limit)
+        self.wait = wait
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future[None]] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return sum(not waiter.done() for waiter in self._waiters)
+
+    async def acquire(self, priority: bool) -> bool:
+        capacity = self.limit if priority else self.limit - self.reserved
+        if self.in_flight < capacity and not (priority and self.waiting):
+            self.in_flight += 1
+            return True
+        if not priority or self.wait <= 0:
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.wait)
+        except asyncio.TimeoutError:
+            return False
+        except asyncio.CancelledError:
+            # Handed a slot just as the client went away; pass it on
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        # release() handed its slot straight to this waiter
+        return True
+
+    def release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self) -> dict[str, int]:
+        return {"in_flight": self.in_flight, "waiting": self.waiting}
+
+
+def parse_networks(
+    value: str,
+) -> list[ipaddress.IPv4Network | ipaddress.IPv6Network]:
+    return [
+        ipaddress.ip_network(part.strip()) for part in value.split(",") if part.strip()
+    ]
+
+
+trusted_proxies = parse_networks(
+    os.getenv("ADMISSION_TRUSTED_PROXIES", "127.0.0.1,::1")
+)
+
+
+def is_trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in trusted_proxies)
+
+
+def client_address(request: Request) -> str:
+    if request.client is None:
+        return "unknown"
+    real_ip = request.headers.get("x-real-ip")
+    if real_ip and is_trusted_proxy(request.client.host):
+        return real_ip
+    return request.client.host
+
+
+def admission(
+    route: str, limiter: RateLimiter, gate: WriteGate, priority: bool
+) -> Callable[[Request], AsyncGenerator[None, None]]:
+    """Dependency that rate limits a write route and holds a gate slot for it"""
+
+    async def admit(request: Request) -> AsyncGenerator[None, None]:
+        if limiter.enabled:
+            wait = limiter.acquire(client_address(request))
+            if wait > 0:
+                requests_shed.inc(route, "rate_limit")
+                raise HTTPException(
+                    status_code=429,
+                    detail="Too many requests",
+                    headers={"Retry-After": str(math.ceil(wait))},
+                )
+
+        if not await gate.acquire(priority):
+            requests_shed.inc(route, "overload")
+            raise HTTPException(
+                status_code=503,
+                detail="Server is busy, try again shortly",
+                headers={"Retry-After": "1"},
+            )
+        try:
+            yield
+        finally:
+            gate.release()
+
+    return admit
+
+
+write_gate = WriteGate(
+    limit=int(os.getenv("ADMISSION_WRITE_LIMIT", "16")),
+    reserved=int(os.getenv("ADMISSION_WRITE_RESERVED", "4")),
+    wait=float(os.getenv("ADMISSION_WRITE_WAIT", "2.0")),
+)
+admit_response = admission(
+    "/responses/",
+    RateLimiter(
+        rate=float(os.getenv("ADMISSION_RESPONSES_RATE", "0.2")),
+        burst=float(os.getenv("ADMISSION_RESPONSES_BURST", "10")),
+    ),
+    write_gate,
+    priority=True,
+)
+admit_progress = admission(
+    "/progress/",
+    RateLimiter(
+        rate=float(os.getenv("ADMISSION_PROGRESS_RATE", "5")),
+        burst=float(os.getenv("ADMISSION_PROGRESS_BURST", "50")),
+    ),
+    write_gate,
+    priority=False,
+)
@@ -0,0 +1,208 @@
+"""analytics.py - streaming quantiles and time-bucket counts for progress events
+
+QuantileSketch is a DDSketch: values are counted in logarithmic bins so every
+quantile estimate is within `relative_accuracy` of a true value, and memory is
+capped by collapsing the lowest bins together once `max_bins` is reached.
+
+The quantiles describe each event's client-reported `timestamp`, the ms the
+visitor took to reach that funnel step. The minute and hour histograms count
+events by `received`, the server's arrival time in ms since the epoch; events
+stored before it was recorded have none and only feed the quantiles.
+"""
+
+import math
+import os
+import threading
+from collections.abc import Iterable
+from typing import Any
+
+MINUTE_MS = 60_000
+HOUR_MS = 3_600_000
+
+
+class QuantileSketch:
+    def __init__(self, relative_accuracy: float = 0.01, max_bins: int = 2048):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.max_bins = max_bins
+        self.count = 0
+        self.zero_count = 0
+        self.bins: dict[int, int] = {}
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        # Elapsed times are never negative; anything not positive is counted as 0
+        if value <= 0:
+            self.zero_count += 1
+            return
+
+        key = math.ceil(math.log(value) / self._log_gamma)
+        self.bins[key] = self.bins.get(key, 0) + 1
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+
+    def quantile(self, q: float) -> float | None:
+        if self.count == 0:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return 2 * self.gamma**key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+    def _collapse(self) -> None:
+        keys = sorted(self.bins)
+        # Fold the lowest bins into the next one, leaving exactly max_bins
+        overflow = keys[: len(keys) - self.max_bins]
+        if not overflow:
+            return
+        merged = sum(self.bins.pop(key) for key in overflow)
+        target = keys[len(overflow)]
+        self.bins[target] += merged
+
+
+class BucketCounter:
+    """Event counts per fixed-width time bucket, keeping only the newest buckets"""
+
+    def __init__(self, width_ms: int, max_buckets: int):
+        self.width_ms = width_ms
+        self.max_buckets = max_buckets
+        self.buckets: dict[int, int] = {}
+
+    def add(self, timestamp: int) -> None:
+        bucket = timestamp // self.width_ms
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        if len(self.buckets) > self.max_buckets:
+            del self.buckets[min(self.buckets)]
+
+    def items(self) -> list[tuple[int, int]]:
+        return [
+            (bucket * self.width_ms, amount)
+            for bucket, amount in sorted(self.buckets.items())
+        ]
+
+
+class HeadlineStats:
+    def __init__(self):
+        self.sketch = QuantileSketch()
+        self.minutes = BucketCounter(MINUTE_MS, max_buckets=24 * 60)
+        self.hours = BucketCounter(HOUR_MS, max_buckets=60 * 24)
+
+    def add(self, timestamp: int, received: int | None) -> None:
+        self.sketch.add(timestamp)
+        if received is not None:
+            self.minutes.add(received)
+            self.hours.add(received)
+
+
+class ProgressAnalytics:
+    """Per-headline sketches, bounded in the number of headlines tracked
+
+    Headlines come from unauthenticated clients, so new ones beyond
+    `max_headlines` are dropped instead of growing memory without limit.
+    """
+
+    def __init__(self, max_headlines: int = 256):
+        self.max_headlines = max_headlines
+        self.dropped = 0
+        self._stats: dict[str, HeadlineStats] = {}
+        self._lock = threading.Lock()
+        self._pending: list[dict[str, Any]] | None = None
+
+    def observe(self, events: Iterable[dict[str, Any]]) -> None:
+        with self._lock:
+            for event in events:
+                if not self._add_event(self._stats, event):
+                    self.dropped += 1
+                if self._pending is not None:
+                    self._pending.append(event)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._stats)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._stats = {}
+            self.dropped = 0
+
+    def begin_rebuild(self) -> None:
+        with self._lock:
+            self._pending = []
+
+    def finish_rebuild(self, rows: Iterable[tuple[str, int, int | None]]) -> None:
+        """Swap in state built from `rows`, replaying events seen meanwhile
+
+        Events committed just before the scan started may be counted twice;
+        the sketches are estimates, so that window is accepted.
+        """
+
+        stats: dict[str, HeadlineStats] = {}
+        dropped = 0
+        for headline, timestamp, received in rows:
+            if not self._add(stats, headline, timestamp, received):
+                dropped += 1
+
+        with self._lock:
+            for event in self._pending or []:
+                if not self._add_event(stats, event):
+                    dropped += 1
+            self._stats = stats
+            self.dropped = dropped
+            self._pending = None
+
+    def quantiles(self, qs: Iterable[float]) -> list[dict[str, Any]]:
+        with self._lock:
+            return [
+                {
+                    "headline": headline,
+                    "amount": stats.sketch.count,
+                    "quantiles": {q: stats.sketch.quantile(q) for q in qs},
+                }
+                for headline, stats in sorted(self._stats.items())
+            ]
+
+    def histogram(
+        self, resolution: str, headline: str | None = None
+    ) -> list[dict[str, Any]]:
+        with self._lock:
+            return [
+                {"headline": name, "start": start, "amount": amount}
+                for name, stats in sorted(self._stats.items())
+                if headline is None or name == headline
+                for start, amount in (
+                    stats.minutes if resolution == "minute" else stats.hours
+                ).items()
+            ]
+
+    def _add_event(
+        self, stats: dict[str, HeadlineStats], event: dict[str, Any]
+    ) -> bool:
+        return self._add(
+            stats, event["headline"], event["timestamp"], event.get("received")
+        )
+
+    def _add(
+        self,
+        stats: dict[str, HeadlineStats],
+        headline: str,
+        timestamp: int,
+        received: int | None,
+    ) -> bool:
+        headline_stats = stats.get(headline)
+        if headline_stats is None:
+            if len(stats) >= self.max_headlines:
+                return False
+            headline_stats = stats[headline] = HeadlineStats()
+        headline_stats.add(timestamp, received)
+        return True
+
+
+progress_analytics = ProgressAnalytics(
+    max_headlines=int(os.getenv("PROGRESS_ANALYTICS_HEADLINES", "256"))
+)
@@ -0,0 +1,42 @@
+from collections.abc import Container
+from typing import Any, cast
+
+from fastapi import HTTPException
+from sqlalchemy import CursorResult, Result
+from sqlmodel import Field  # pyright: ignore[reportUnknownVariableType]
+from sqlmodel import SQLModel
+
+
+class BulkResult(SQLModel):
+    affected: int = Field()
+
+
+def affected_rows(result: Result[Any]) -> int:
+    """Rows an UPDATE or DELETE matched; execute() is only typed as a Result"""
+
+    return cast(CursorResult[Any], result).rowcount
+
+
+def require_filter(*filters: object) -> None:
+    """Refuse bulk statements that would silently apply to every row"""
+
+    if all(value is None for value in filters):
+        raise HTTPException(
+            status_code=400, detail="Bulk operations need at least one filter"
+        )
+
+
+def patch_values(
+    patch: SQLModel | None, nullable: Container[str] = ()
+) -> dict[str, Any]:
+    """Fields a bulk patch sets, ignoring nulls for columns that can't be null"""
+
+    fields = patch.model_dump(exclude_unset=True) if patch else {}
+    values = {
+        name: value
+        for name, value in fields.items()
+        if value is not None or name in nullable
+    }
+    if not values:
+        raise HTTPException(status_code=400, detail="Nothing to patch")
+    return values
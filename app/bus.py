@@ -0,0 +1,140 @@
+"""bus.py - events from the write paths to in-process consumers in every worker
+
+In a single process publish() calls the handlers directly. When workers share
+a state directory, events are appended as JSON lines to a file there and every
+worker tails it, so handlers in all processes (the publisher's included) see
+every event in the same order, on their event loop.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+from .shared import BUS_GENERATION, SharedState, shared_state
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[int, Any], None]
+
+# Sequence numbers are generation << 40 | byte offset, so they keep growing
+# across rotations of the bus file.
+GENERATION_SHIFT = 40
+
+
+class EventBus:
+    def __init__(
+        self, state: SharedState, interval: float = 0.05, max_bytes: int = 16 << 20
+    ):
+        self.state = state
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self._handlers: dict[str, list[Handler]] = {}
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._task: asyncio.Task[None] | None = None
+
+    @property
+    def shared(self) -> bool:
+        return self.state.shared
+
+    def subscribe(self, kind: str, handler: Handler) -> None:
+        self._handlers.setdefault(kind, []).append(handler)
+
+    def publish(self, kind: str, data: Any) -> None:
+        if not self.shared:
+            with self._lock:
+                self._seq += 1
+                seq = self._seq
+            self._dispatch(seq, kind, data)
+            return
+
+        line = json.dumps([kind, data], separators=(",", ":"), default=str) + "\n"
+        with self.state.locked():
+            generation = self.state.get(BUS_GENERATION)
+            fd = os.open(
+                self._path(generation), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600
+            )
+            try:
+                _ = os.write(fd, line.encode())
+                size = os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+
+            if size >= self.max_bytes:
+                # Readers still holding the old file finish it before moving on
+                Path(self._path(generation + 1)).touch()
+                _ = self.state.increment(BUS_GENERATION)
+                os.unlink(self._path(generation))
+
+    def start(self) -> None:
+        if self.shared and self._task is None:
+            generation = self.state.get(BUS_GENERATION)
+            fd = os.open(self._path(generation), os.O_RDONLY | os.O_CREAT, 0o600)
+            # Only events published after this worker started are delivered
+            position = os.fstat(fd).st_size
+            self._task = asyncio.create_task(self.run(generation, fd, position))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            _ = self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run(self, generation: int, fd: int, position: int) -> None:
+        buffer = b""
+        try:
+            while True:
+                chunk = os.pread(fd, 1 << 20, position)
+                if chunk:
+                    start = position - len(buffer)
+                    position += len(chunk)
+                    *lines, buffer = (buffer + chunk).split(b"\n")
+                    for line in lines:
+                        self._deliver((generation << GENERATION_SHIFT) | start, line)
+                        start += len(line) + 1
+                    continue
+
+                current = self.state.get(BUS_GENERATION)
+                if current != generation:
+                    # Drain anything written before the rotation, then move on
+                    if os.pread(fd, 1, position):
+                        continue
+                    os.close(fd)
+                    generation, position, buffer = current, 0, b""
+                    fd = os.open(
+                        self._path(generation), os.O_RDONLY | os.O_CREAT, 0o600
+                    )
+                    continue
+
+                await asyncio.sleep(self.interval)
+        finally:
+            os.close(fd)
+
+    def _deliver(self, seq: int, line: bytes) -> None:
+        try:
+            kind, data = json.loads(line)
+        except ValueError:
+            return
+        self._dispatch(seq, kind, data)
+
+    def _dispatch(self, seq: int, kind: str, data: Any) -> None:
+        for handler in self._handlers.get(kind, ()):
+            try:
+                handler(seq, data)
+            except Exception:
+                logger.exception("Event bus handler for %s failed", kind)
+
+    def _path(self, generation: int) -> str:
+        assert self.state.directory is not None
+        return str(self.state.directory / f"bus-{generation}.log")
+
+
+bus = EventBus(shared_state)
@@ -0,0 +1,184 @@
+import threading
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Sequence
+from dataclasses import dataclass, field
+from typing import Any, get_args
+
+import orjson
+from fastapi import HTTPException, Request, Response
+from sqlalchemy import Row
+
+from .coalesce import SingleFlight, auth_scope
+from .compression import MIN_SIZE, compress, negotiate
+from .pagination import Page
+from .shared import (
+    GUESTS_VERSION,
+    PROGRESS_VERSION,
+    RESPONSES_VERSION,
+    SharedState,
+    shared_state,
+)
+
+
+@dataclass
+class CachedBody:
+    version: int
+    body: bytes
+    headers: dict[str, str]
+    # Compressed copies, made the first time a client asks for each encoding
+    encoded: dict[str, bytes] = field(default_factory=dict)
+
+
+def encode_rows(rows: Sequence[Any], names: list[str]) -> bytes:
+    """JSON for rows whose columns already have the response model's types
+
+    The rows come from our own queries, so validating them into models only
+    to dump them again is skipped; orjson encodes the fields directly.
+    """
+
+    if rows and isinstance(rows[0], Row):
+        items = [{name: row._mapping[name] for name in names} for row in rows]
+    else:
+        items = [{name: getattr(row, name) for name in names} for row in rows]
+    return orjson.dumps(items)
+
+
+class ResponseCache:
+    """Serialized list responses cached per data version
+
+    Write handlers call bump() after committing. Bodies are keyed by path and
+    query string and only served for the version they were built at, and each
+    response carries an ETag for that version so unchanged polls get a 304.
+    The version lives in shared state, so a write in one worker invalidates
+    the bodies cached by all of them. Bodies built from a read snapshot also
+    carry the snapshot's version, so they are rebuilt and re-tagged when the
+    snapshot is refreshed.
+
+    Bodies of at least COMPRESSION_MIN_SIZE bytes are sent brotli or gzip
+    encoded as the client prefers, compressed once per cached body. Concurrent
+    misses for the same body share a single build.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        slot: int,
+        state: SharedState = shared_state,
+        maxsize: int = 64,
+    ):
+        self.name = name
+        self.slot = slot
+        self.state = state
+        self.maxsize = maxsize
+        self._bodies: OrderedDict[str, CachedBody] = OrderedDict()
+        self._lock = threading.Lock()
+        self._flights: SingleFlight[CachedBody] = SingleFlight(name)
+
+    @property
+    def version(self) -> int:
+        return self.state.get(self.slot)
+
+    def bump(self) -> None:
+        _ = self.state.bump(self.slot)
+        with self._lock:
+            self._bodies.clear()
+
+    def etag(self, version: int, snapshot: str | None = None) -> str:
+        # Versions restart from zero with each run, so ETags carry the run's
+        # boot id to never match a body served before a restart.
+        if snapshot is not None:
+            return f'"{self.state.boot_id}-{version}-{snapshot}"'
+        return f'"{self.state.boot_id}-{version}"'
+
+    async def respond(
+        self,
+        request: Request,
+        build: Callable[[], Awaitable[Any]],
+        response_model: Any,
+        fields: set[str] | None = None,
+        snapshot: str | None = None,
+    ) -> Response:
+        version = self.version
+        etag = self.etag(version, snapshot)
+        encoding = negotiate(request.headers.get("accept-encoding"))
+        # Each encoding is a different representation with its own ETag
+        encoded_etag = f'{etag[:-1]}-{encoding}"' if encoding else etag
+        headers = {"Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            candidates = {
+                tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+            }
+            for tag in (etag, encoded_etag):
+                if tag in candidates or "*" in candidates:
+                    return Response(status_code=304, headers=headers | {"ETag": tag})
+
+        (item_model,) = get_args(response_model)
+        if fields is not None:
+            unknown = fields - item_model.model_fields.keys()
+            if unknown:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Unknown fields: {', '.join(sorted(unknown))}",
+                )
+
+        key = f"{request.url.path}?{request.url.query}#{snapshot}"
+        with self._lock:
+            cached = self._bodies.get(key)
+            if cached is not None and cached.version == version:
+                self._bodies.move_to_end(key)
+            else:
+                cached = None
+
+        async def build_body() -> CachedBody:
+            content = await build()
+            page_headers: dict[str, str] = {}
+            if isinstance(content, Page):
+                if content.next_cursor is not None:
+                    next_url = request.url.include_query_params(
+                        cursor=content.next_cursor
+                    )
+                    page_headers["X-Next-Cursor"] = content.next_cursor
+                    page_headers["Link"] = f'<{next_url}>; rel="next"'
+                content = content.items
+
+            names = [
+                name
+                for name in item_model.model_fields
+                if fields is None or name in fields
+            ]
+            built = CachedBody(version, encode_rows(content, names), page_headers)
+
+            with self._lock:
+                if self.version == version:
+                    self._bodies[key] = built
+                    while len(self._bodies) > self.maxsize:
+                        _ = self._bodies.popitem(last=False)
+            return built
+
+        if cached is None:
+            # Identical misses from the same caller share one build; the
+            # version keeps a build started before a write from being handed
+            # to requests made after it.
+            flight = f"{version}:{auth_scope(request)}:{key}"
+            cached = await self._flights.do(flight, build_body)
+
+        body = cached.body
+        if encoding is not None and len(body) >= MIN_SIZE:
+            encoded = cached.encoded.get(encoding)
+            if encoded is None:
+                encoded = cached.encoded[encoding] = compress(body, encoding)
+            body = encoded
+            headers |= {"ETag": encoded_etag, "Content-Encoding": encoding}
+        else:
+            headers["ETag"] = etag
+
+        return Response(
+            body, media_type="application/json", headers=headers | cached.headers
+        )
+
+
+guests_cache = ResponseCache("guests", GUESTS_VERSION)
+responses_cache = ResponseCache("responses", RESPONSES_VERSION)
+progress_cache = ResponseCache("progress", PROGRESS_VERSION)
@@ -0,0 +1,181 @@
+import tempfile
+import time
+
+import typer
+from sqlmodel import Session, SQLModel, create_engine
+
+from .database import get_engine
+from .migrations import (
+    MIGRATIONS,
+    explain_query_plans,
+    migrate,
+    schema_sql,
+    schema_version,
+)
+from .passwords import PARAMS_FILE, argon2_params, calibrate, save_params
+from .progress_log import ProgressLog
+from .rollup import rebuild_group_counts, verify_group_counts
+from .routers.progress import (
+    Progress,
+    insert_progresses,
+    progress_log,
+    rebuild_aggregates,
+    verify_aggregates,
+)
+
+cli = typer.Typer()
+
+
+@cli.command("migrate")
+def run_migrations():
+    """Apply pending schema migrations"""
+
+    applied = migrate()
+    for migration in applied:
+        typer.echo(f"Applied {migration.version}: {migration.description}")
+    with get_engine().connect() as connection:
+        typer.echo(f"Schema version {schema_version(connection)} of {len(MIGRATIONS)}")
+
+
+@cli.command()
+def explain_queries():
+    """Print the EXPLAIN QUERY PLAN of every router query"""
+
+    _ = migrate()
+    with get_engine().connect() as connection:
+        for name, lines in explain_query_plans(connection).items():
+            typer.echo(name)
+            for line in lines:
+                typer.echo(f"  {line}")
+
+
+@cli.command()
+def schema():
+    """Print the DDL the models and migrations produce"""
+
+    typer.echo(schema_sql(), nl=False)
+
+
+@cli.command()
+def compact_progress():
+    """Apply all pending progress log segments to the database"""
+
+    _ = migrate()
+    typer.echo(f"Applied {progress_log.replay()} events")
+
+
+@cli.command()
+def rebuild_progress_aggregates():
+    """Recompute the progress aggregate store from the raw Progress table"""
+
+    _ = migrate()
+    with Session(get_engine()) as session:
+        rebuild_aggregates(session)
+        session.commit()
+    typer.echo("Progress aggregates rebuilt")
+
+
+@cli.command()
+def verify_progress_aggregates():
+    """Check the progress aggregate store against the raw Progress table"""
+
+    _ = migrate()
+    with Session(get_engine()) as session:
+        mismatches = verify_aggregates(session)
+    for mismatch in mismatches:
+        typer.echo(mismatch)
+    if mismatches:
+        raise typer.Exit(code=1)
+    typer.echo("Progress aggregates match the raw table")
+
+
+@cli.command()
+def rebuild_guest_summary():
+    """Recompute the per-group RSVP counts from the Guest and Response tables"""
+
+    _ = migrate()
+    with Session(get_engine()) as session:
+        rebuild_group_counts(session)
+        session.commit()
+    typer.echo("Guest summary rebuilt")
+
+
+@cli.command()
+def verify_guest_summary():
+    """Check the per-group RSVP counts against the Guest and Response tables"""
+
+    _ = migrate()
+    with Session(get_engine()) as session:
+        mismatches = verify_group_counts(session)
+    for mismatch in mismatches:
+        typer.echo(mismatch)
+    if mismatches:
+        raise typer.Exit(code=1)
+    typer.echo("Guest summary matches the Guest and Response tables")
+
+
+@cli.command()
+def calibrate_passwords(
+    target_ms: float = typer.Option(250, help="Verify latency to aim for"),
+    max_memory: int = typer.Option(64 * 1024, help="Memory cost ceiling in KiB"),
+    parallelism: int = typer.Option(1, help="argon2 lanes per hash"),
+    output: str = typer.Option(PARAMS_FILE, help="Where to save the parameters"),
+    dry_run: bool = typer.Option(False, help="Only print the parameters"),
+):
+    """Pick argon2 costs whose verify takes about target_ms on this host
+
+    Run it on the hardware that serves logins. One lane per hash keeps the
+    cost of a login to one core for that long; the password pool already
+    runs several logins side by side. Existing hashes are upgraded to the
+    new parameters on their next successful login after a restart.
+    """
+
+    params, elapsed = calibrate(target_ms / 1000, max_memory, parallelism)
+    typer.echo(
+        f"time_cost={params.time_cost} memory_cost={params.memory_cost} KiB"
+        f" parallelism={params.parallelism}: verify takes {elapsed * 1000:.0f} ms"
+    )
+    typer.echo(
+        f"Current: time_cost={argon2_params.time_cost}"
+        f" memory_cost={argon2_params.memory_cost} KiB"
+        f" parallelism={argon2_params.parallelism}"
+    )
+    if elapsed > target_ms / 1000:
+        typer.echo("Even the cheapest parameters tried exceed the target")
+    if not dry_run:
+        save_params(params, output, target_ms=target_ms, measured_ms=elapsed * 1000)
+        typer.echo(f"Saved to {output}; ARGON2_* environment variables override it")
+
+
+@cli.command()
+def bench_progress(events: int = 5000):
+    """Compare per-row commits against log ingestion with compaction"""
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{directory}/bench.db")
+        SQLModel.metadata.create_all(engine)
+
+        start = time.perf_counter()
+        with Session(engine) as session:
+            for i in range(events):
+                db_progress = Progress(timestamp=i, headline=f"h{i % 10}")
+                session.add(db_progress)
+                session.commit()
+                session.refresh(db_progress)
+        per_row = events / (time.perf_counter() - start)
+
+        log = ProgressLog(f"{directory}/log", insert_progresses, engine=engine)
+        start = time.perf_counter()
+        for i in range(events):
+            log.append({"timestamp": i, "headline": f"h{i % 10}"})
+        ingest = events / (time.perf_counter() - start)
+        _ = log.compact()
+        end_to_end = events / (time.perf_counter() - start)
+
+    typer.echo(f"per-row commits:     {per_row:12.0f} events/s")
+    typer.echo(f"log append:          {ingest:12.0f} events/s")
+    typer.echo(f"append + compaction: {end_to_end:12.0f} events/s")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,99 @@
+"""coalesce.py - single-flight sharing of identical concurrent computations
+
+When several requests need the same result at once, the first one computes
+it and the rest wait for that instead of running the same query again. Keys
+must cover everything the result depends on: for a route, its method, path
+and query and the caller's credentials, so an answer is never handed to a
+request authorized differently.
+
+Read routes opt in through CoalesceDep and run their work with `do`. A waiter
+gets the answer of a query that started before it arrived, so only routes that
+can tolerate that should opt in.
+"""
+
+import asyncio
+import hashlib
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import Any, Generic, TypeVar
+
+from fastapi import Request
+
+from .metrics import requests_coalesced
+
+T = TypeVar("T")
+
+
+class Abandoned(Exception):
+    """The request computing a shared result was cancelled before finishing"""
+
+
+class SingleFlight(Generic[T]):
+    """Runs one computation per key at a time and shares its outcome
+
+    Only the leader's own computation runs; it uses the leader's request
+    scoped resources (like its session), so if the leader is cancelled the
+    waiters fall back to computing for themselves. Errors are shared like
+    results, since the waiters' attempts would fail the same way.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._flights: dict[str, asyncio.Future[T]] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def do(self, key: str, compute: Callable[[], Awaitable[T]]) -> T:
+        while True:
+            flight = self._flights.get(key)
+            if flight is None:
+                break
+            requests_coalesced.inc(self.name)
+            try:
+                return await asyncio.shield(flight)
+            except Abandoned:
+                continue
+
+        flight = asyncio.get_running_loop().create_future()
+        self._flights[key] = flight
+        try:
+            result = await compute()
+        except BaseException as e:
+            flight.set_exception(e if isinstance(e, Exception) else Abandoned())
+            # Nobody may be waiting; don't warn about an unretrieved error
+            _ = flight.exception()
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            del self._flights[key]
+
+
+def auth_scope(request: Request) -> str:
+    """Digest of the caller's credentials, empty for anonymous callers"""
+
+    authorization = request.headers.get("authorization")
+    if authorization is None:
+        return ""
+    return hashlib.sha256(authorization.encode()).hexdigest()
+
+
+@dataclass
+class Coalesced:
+    """The flight for one request; identical concurrent requests share `do`"""
+
+    flights: SingleFlight[Any]
+    key: str
+
+    async def do(self, compute: Callable[[], Awaitable[T]]) -> T:
+        return await self.flights.do(self.key, compute)
+
+
+route_flights: SingleFlight[Any] = SingleFlight("route")
+
+
+def get_coalesced(request: Request) -> Coalesced:
+    key = f"{request.method} {request.url.path}?{request.url.query}"
+    return Coalesced(route_flights, f"{key}#{auth_scope(request)}")
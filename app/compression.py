@@ -0,0 +1,46 @@
+"""compression.py - Accept-Encoding negotiation and brotli/gzip encoding"""
+
+import gzip
+import os
+
+import brotli
+
+# Bodies smaller than this fit in a packet or two and aren't worth the CPU
+MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+
+# In order of preference when the client accepts several equally
+ENCODINGS = ("br", "gzip")
+
+
+def negotiate(accept_encoding: str | None) -> str | None:
+    """Pick the best encoding the client accepts, or None for identity"""
+
+    if not accept_encoding:
+        return None
+
+    weights: dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                continue
+        weights[name.strip().lower()] = weight
+
+    best, best_weight = None, 0.0
+    for encoding in ENCODINGS:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
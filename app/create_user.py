@@ -1,8 +1,8 @@
 import typer
-from passlib.hash import argon2
 from sqlmodel import Session, SQLModel, create_engine, text
 
 from .database import get_engine
+from .passwords import password_pool
 
 cli = typer.Typer()
 
@@ -22,7 +22,9 @@ def create_user(username: str, password: str):
                 "INSERT INTO User (username, hashed_password, disabled) VALUES (:username, :password, False);"
             )
             session.exec(
-                query.bindparams(username=username, password=argon2.hash(password))
+                query.bindparams(
+                    username=username, password=password_pool.hash_sync(password)
+                )
             )
             session.commit()
             typer.echo(f"User '{username}' created successfully")
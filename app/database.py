@@ -1,22 +1,153 @@
-from collections.abc import Generator
+import os
+from collections.abc import AsyncGenerator, Generator
+from typing import Any
 
+from sqlalchemy import Engine, event
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 from sqlmodel import Session, SQLModel, create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-sqlite_file = "db_data/database.db"
+from .metrics import instrument_engine
+
+sqlite_file = os.getenv("SQLITE_FILE", "db_data/database.db")
 sqlite_url = f"sqlite:///{sqlite_file}"
+async_sqlite_url = f"sqlite+aiosqlite:///{sqlite_file}"
+
+# Applied to every new connection. journal_mode is persistent in the file and
+# needs a write, so read-only connections skip it.
+sqlite_pragmas = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "cache_size": os.getenv("SQLITE_CACHE_SIZE", "-16000"),
+    "mmap_size": os.getenv("SQLITE_MMAP_SIZE", "268435456"),
+    "busy_timeout": os.getenv("SQLITE_BUSY_TIMEOUT", "5000"),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
+
+
+def set_sqlite_pragmas(
+    dbapi_connection: Any, pragmas: dict[str, str], readonly: bool = False
+) -> None:
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        if readonly and name == "journal_mode":
+            continue
+        _ = cursor.execute(f"PRAGMA {name}={value}")
+    if readonly:
+        _ = cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+def create_sqlite_engine(
+    url: str = sqlite_url,
+    readonly: bool = False,
+    pool_size: int = 1,
+    pool_timeout: float = 30.0,
+    pragmas: dict[str, str] | None = None,
+) -> Engine:
+    """Create an engine with tuned pragmas and a fixed-size connection pool
+
+    SQLite allows one writer at a time, so the write engine defaults to a
+    single pooled connection: writers queue in the pool instead of spinning
+    on the database lock. Readers never block in WAL mode and get more.
+    """
+
+    new_engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        poolclass=QueuePool,
+        pool_size=pool_size,
+        max_overflow=0,
+        pool_timeout=pool_timeout,
+    )
+
+    @event.listens_for(new_engine, "connect")
+    def on_connect(dbapi_connection: Any, _: Any):  # pyright: ignore[reportUnusedFunction]
+        set_sqlite_pragmas(dbapi_connection, pragmas or sqlite_pragmas, readonly)
+
+    return new_engine
+
+
+def create_async_sqlite_engine(
+    url: str = async_sqlite_url,
+    readonly: bool = False,
+    pool_size: int = 1,
+    pool_timeout: float = 30.0,
+    pragmas: dict[str, str] | None = None,
+) -> AsyncEngine:
+    new_engine = create_async_engine(
+        url,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=pool_size,
+        max_overflow=0,
+        pool_timeout=pool_timeout,
+    )
+
+    @event.listens_for(new_engine.sync_engine, "connect")
+    def on_connect(dbapi_connection: Any, _: Any):  # pyright: ignore[reportUnusedFunction]
+        set_sqlite_pragmas(dbapi_connection, pragmas or sqlite_pragmas, readonly)
+
+    return new_engine
+
+
+engine = create_sqlite_engine(
+    pool_size=int(os.getenv("SQLITE_WRITE_POOL_SIZE", "1")),
+)
+read_engine = create_sqlite_engine(
+    readonly=True,
+    pool_size=int(os.getenv("SQLITE_READ_POOL_SIZE", "8")),
+)
+async_engine = create_async_sqlite_engine(
+    pool_size=int(os.getenv("SQLITE_WRITE_POOL_SIZE", "1")),
+)
+async_read_engine = create_async_sqlite_engine(
+    readonly=True,
+    pool_size=int(os.getenv("SQLITE_READ_POOL_SIZE", "8")),
+)
 
-connect_args = {"check_same_thread": False}
-engine = create_engine(sqlite_url, connect_args=connect_args)
+instrument_engine(engine, "write")
+instrument_engine(read_engine, "read")
+instrument_engine(async_engine.sync_engine, "async_write")
+instrument_engine(async_read_engine.sync_engine, "async_read")
 
 
 def get_engine():
     return engine
 
 
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+def get_read_engine():
+    return read_engine
+
+
+def get_async_engine():
+    return async_engine
+
+
+def get_async_read_engine():
+    return async_read_engine
 
 
 def get_session() -> Generator[Session, None, None]:
     with Session(engine) as session:
         yield session
+
+
+def get_read_session() -> Generator[Session, None, None]:
+    with Session(read_engine) as session:
+        yield session
+
+
+async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+
+
+async def get_async_read_session() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSession(async_read_engine, expire_on_commit=False) as session:
+        yield session
+
+
+async def dispose_async_engines() -> None:
+    await async_engine.dispose()
+    await async_read_engine.dispose()
@@ -1,29 +1,129 @@
+import hashlib
 import os
-from typing import Annotated
+import threading
+import time
+from collections import OrderedDict
+from typing import Annotated, Any
 
 import jwt
 from dotenv import load_dotenv
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from .database import get_session
+from .admission import admit_progress, admit_response
+from .coalesce import Coalesced, get_coalesced
+from .database import (
+    get_async_read_session,
+    get_async_session,
+    get_read_session,
+    get_session,
+)
+from .idempotency import Idempotency, get_idempotency
+from .snapshot import get_async_snapshot_session
 
 _ = load_dotenv()
 SECRET_KEY = os.getenv("SECRET")
 ALGORITHM = "HS256"
 
+
+class TokenCache:
+    """LRU cache of verified JWT payloads keyed by token digest
+
+    Entries are dropped once the token's exp passes, so a cached token is never
+    accepted for longer than jwt.decode would accept it.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[bytes, tuple[float, dict[str, Any]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> dict[str, Any] | None:
+        key = hashlib.sha256(token.encode()).digest()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires, payload = entry
+            if expires <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def put(self, token: str, payload: dict[str, Any]) -> None:
+        expires = payload.get("exp")
+        if not isinstance(expires, (int, float)):
+            return
+
+        key = hashlib.sha256(token.encode()).digest()
+        with self._lock:
+            self._entries[key] = (float(expires), payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                _ = self._entries.popitem(last=False)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+token_cache = TokenCache(maxsize=int(os.getenv("TOKEN_CACHE_SIZE", "1024")))
+
 SessionDep: Annotated[Session, Depends(get_session)] = Depends(get_session)
+ReadSessionDep: Annotated[Session, Depends(get_read_session)] = Depends(
+    get_read_session
+)
+AsyncSessionDep: Annotated[AsyncSession, Depends(get_async_session)] = Depends(
+    get_async_session
+)
+AsyncReadSessionDep: Annotated[AsyncSession, Depends(get_async_read_session)] = (
+    Depends(get_async_read_session)
+)
+AsyncSnapshotSessionDep: Annotated[
+    AsyncSession, Depends(get_async_snapshot_session)
+] = Depends(get_async_snapshot_session)
+# Listed in a route's dependencies=[...] rather than taken as a parameter
+ResponseAdmissionDep = Depends(admit_response)
+ProgressAdmissionDep = Depends(admit_progress)
+IdempotencyDep: Annotated[Idempotency, Depends(get_idempotency)] = Depends(
+    get_idempotency
+)
+CoalesceDep: Annotated[Coalesced, Depends(get_coalesced)] = Depends(get_coalesced)
 
 auth_scheme = OAuth2PasswordBearer(
         tokenUrl="https://api.jannejaroosa.fi/auth/login")
 
 
-def validate_token(token: str = Depends(auth_scheme)) -> dict:
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+def decode_token(token: str) -> dict:
+    """Verify a JWT through the token cache; raises jwt errors when invalid"""
+
+    payload = token_cache.get(token)
+    if payload is not None:
         return payload
 
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    token_cache.put(token, payload)
+    return payload
+
+
+async def validate_token(token: str = Depends(auth_scheme)) -> dict:
+    try:
+        return decode_token(token)
+
     except Exception:
         raise HTTPException(
             status_code=401,
@@ -0,0 +1,103 @@
+"""feed.py - fan-out of live change deltas to WebSocket subscribers"""
+
+import asyncio
+import enum
+import json
+import os
+from typing import Any
+
+from .bus import bus
+
+
+class Closed(enum.Enum):
+    """Queued in place of a message to tell a subscriber its stream has ended"""
+
+    CLOSED = enum.auto()
+
+
+CLOSED = Closed.CLOSED
+FeedQueue = asyncio.Queue[str | Closed]
+
+
+class FeedBroadcaster:
+    """Publishes deltas to every subscriber through bounded queues
+
+    Each delta is encoded once and the same string is queued for every
+    subscriber. A subscriber whose queue fills up is dropped rather than
+    letting it hold messages for everyone else. publish() may be called from
+    any thread; deltas go through the event bus so subscribers of every worker
+    get them, and fan-out always happens on the event loop.
+    """
+
+    def __init__(self, queue_size: int, max_subscribers: int):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.seq = 0
+        self.dropped = 0
+        self._subscribers: set[FeedQueue] = set()
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def subscribe(self) -> FeedQueue | None:
+        if len(self._subscribers) >= self.max_subscribers:
+            return None
+
+        self._loop = asyncio.get_running_loop()
+        queue: FeedQueue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: FeedQueue) -> None:
+        self._subscribers.discard(queue)
+
+    def close(self, queue: FeedQueue) -> None:
+        """End a subscriber's stream, discarding anything still queued"""
+
+        self._subscribers.discard(queue)
+        while not queue.empty():
+            _ = queue.get_nowait()
+        queue.put_nowait(CLOSED)
+
+    def publish(self, kind: str, data: Any) -> None:
+        if not bus.shared and not self._subscribers:
+            return
+        bus.publish("feed", {"type": kind, "data": data})
+
+    def deliver(self, seq: int, delta: dict[str, Any]) -> None:
+        loop = self._loop
+        if not self._subscribers or loop is None or loop.is_closed():
+            self.seq = seq
+            return
+
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if running is loop:
+            self._fan_out(seq, delta)
+        else:
+            loop.call_soon_threadsafe(self._fan_out, seq, delta)
+
+    def _fan_out(self, seq: int, delta: dict[str, Any]) -> None:
+        self.seq = seq
+        message = json.dumps({"seq": seq} | delta, default=str)
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self.dropped += 1
+                self.close(queue)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "subscribers": len(self._subscribers),
+            "seq": self.seq,
+            "dropped": self.dropped,
+        }
+
+
+feed = FeedBroadcaster(
+    queue_size=int(os.getenv("FEED_QUEUE_SIZE", "256")),
+    max_subscribers=int(os.getenv("FEED_MAX_SUBSCRIBERS", "1000")),
+)
+bus.subscribe("feed", feed.deliver)
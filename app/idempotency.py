@@ -0,0 +1,252 @@
+"""idempotency.py - Idempotency-Key handling for the public write endpoints
+
+A client that retries a POST with the same Idempotency-Key gets the response
+of the first attempt back instead of writing again. Completed responses are
+kept in a small in-memory LRU per process and in the IdempotencyKey table,
+which is written in the same transaction as the request's own changes, so a
+key is recorded exactly when its write commits. Both expire after
+IDEMPOTENCY_TTL seconds.
+
+A key reused for a different request body is refused with 422, and a retry
+arriving while the first attempt is still running in this process with 409.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import AsyncGenerator
+from dataclasses import dataclass
+
+from fastapi import HTTPException, Request, Response
+from sqlalchemy import delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Field  # pyright: ignore[reportUnknownVariableType]
+from sqlmodel import SQLModel, col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .database import get_async_read_engine
+
+MAX_KEY_LENGTH = 255
+# Expired rows are deleted by every this many saves
+PRUNE_EVERY = 100
+
+
+class IdempotencyKey(SQLModel, table=True):
+    key: str = Field(primary_key=True)
+    fingerprint: str = Field()
+    status_code: int = Field()
+    body: str = Field()
+    created: int = Field(index=True)
+
+
+@dataclass
+class StoredResponse:
+    fingerprint: str
+    status_code: int
+    body: str
+    created: float
+
+
+class IdempotencyStore:
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.replays = 0
+        self._entries: OrderedDict[str, StoredResponse] = OrderedDict()
+        self._running: set[str] = set()
+        self._lock = threading.Lock()
+        self._saves = 0
+
+    def get(self, key: str) -> StoredResponse | None:
+        with self._lock:
+            stored = self._entries.get(key)
+            if stored is None:
+                return None
+            if stored.created + self.ttl <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return stored
+
+    def put(self, key: str, stored: StoredResponse) -> None:
+        with self._lock:
+            self._entries[key] = stored
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                _ = self._entries.popitem(last=False)
+
+    async def load(self, key: str) -> StoredResponse | None:
+        stored = self.get(key)
+        if stored is not None:
+            return stored
+
+        async with AsyncSession(get_async_read_engine()) as session:
+            row = (
+                await session.exec(
+                    select(IdempotencyKey).where(
+                        IdempotencyKey.key == key,
+                        col(IdempotencyKey.created) > time.time() - self.ttl,
+                    )
+                )
+            ).first()
+        if row is None:
+            return None
+
+        stored = StoredResponse(
+            row.fingerprint, row.status_code, row.body, float(row.created)
+        )
+        self.put(key, stored)
+        return stored
+
+    def due_for_prune(self) -> bool:
+        with self._lock:
+            self._saves += 1
+            return self._saves % PRUNE_EVERY == 0
+
+    def begin(self, key: str) -> bool:
+        with self._lock:
+            if key in self._running:
+                return False
+            self._running.add(key)
+            return True
+
+    def end(self, key: str) -> None:
+        with self._lock:
+            self._running.discard(key)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.max_entries,
+            "hits": self.hits,
+            "replays": self.replays,
+        }
+
+
+idempotency_store = IdempotencyStore(
+    ttl=float(os.getenv("IDEMPOTENCY_TTL", str(24 * 60 * 60))),
+    max_entries=int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "4096")),
+)
+
+
+def replay(stored: StoredResponse) -> Response:
+    return Response(
+        stored.body,
+        status_code=stored.status_code,
+        media_type="application/json",
+        headers={"Idempotent-Replayed": "true"},
+    )
+
+
+class Idempotency:
+    """The Idempotency-Key of one request, if it has one
+
+    Handlers return `replay` when it is set. Otherwise they call save() with
+    their result before committing; when it returns a response instead, the
+    same key was committed by another process in the meantime and the
+    handler rolls back and returns that.
+    """
+
+    def __init__(
+        self, store: IdempotencyStore, key: str | None = None, fingerprint: str = ""
+    ):
+        self.store = store
+        self.key = key
+        self.fingerprint = fingerprint
+        self.replay: Response | None = None
+        self.saved: StoredResponse | None = None
+
+    async def save(
+        self, session: AsyncSession, result: SQLModel, status_code: int = 200
+    ) -> Response | None:
+        if self.key is None:
+            return None
+
+        now = time.time()
+        stored = StoredResponse(
+            self.fingerprint, status_code, result.model_dump_json(), now
+        )
+        values = {
+            "fingerprint": stored.fingerprint,
+            "status_code": stored.status_code,
+            "body": stored.body,
+            "created": int(now),
+        }
+        insert = sqlite_insert(IdempotencyKey).values(key=self.key, **values)
+        # An expired row that hasn't been pruned yet is taken over
+        inserted = (
+            await session.execute(
+                insert.on_conflict_do_update(
+                    index_elements=[IdempotencyKey.key],
+                    set_=values,
+                    where=col(IdempotencyKey.created) <= now - self.store.ttl,
+                ).returning(col(IdempotencyKey.key))
+            )
+        ).first()
+        if inserted is None:
+            existing = await self.store.load(self.key)
+            if existing is None:
+                raise HTTPException(
+                    status_code=409,
+                    detail="A request with this Idempotency-Key is still in progress",
+                    headers={"Retry-After": "1"},
+                )
+            return self.check(existing)
+
+        if self.store.due_for_prune():
+            _ = await session.execute(
+                delete(IdempotencyKey).where(
+                    col(IdempotencyKey.created) <= now - self.store.ttl
+                )
+            )
+        self.saved = stored
+        return None
+
+    def check(self, stored: StoredResponse) -> Response:
+        if stored.fingerprint != self.fingerprint:
+            raise HTTPException(
+                status_code=422,
+                detail="Idempotency-Key was already used for a different request",
+            )
+        self.store.replays += 1
+        return replay(stored)
+
+
+async def get_idempotency(request: Request) -> AsyncGenerator[Idempotency, None]:
+    key = request.headers.get("idempotency-key")
+    if key is None:
+        yield Idempotency(idempotency_store)
+        return
+
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters",
+        )
+
+    scoped = f"{request.method} {request.url.path} {key}"
+    digest = hashlib.sha256(await request.body())
+    idempotency = Idempotency(idempotency_store, scoped, digest.hexdigest())
+
+    stored = await idempotency_store.load(scoped)
+    if stored is not None:
+        idempotency.replay = idempotency.check(stored)
+        yield idempotency
+        return
+
+    if not idempotency_store.begin(scoped):
+        raise HTTPException(
+            status_code=409,
+            detail="A request with this Idempotency-Key is still in progress",
+            headers={"Retry-After": "1"},
+        )
+    try:
+        yield idempotency
+        if idempotency.saved is not None:
+            idempotency_store.put(scoped, idempotency.saved)
+    finally:
+        idempotency_store.end(scoped)
@@ -1,5 +1,6 @@
 """api.py - fastapi implementation of the wedding-site api"""
 
+import os
 from contextlib import asynccontextmanager
 
 from dotenv import load_dotenv
@@ -7,16 +8,55 @@ from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.httpsredirect import HTTPSRedirectMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
+from sqlmodel import Session
+
+from .bus import bus
+from .database import dispose_async_engines, get_engine
+from .metrics import MetricsMiddleware
+from .migrations import migrate
+from .routers import (
+    auth_router,
+    feed_router,
+    guests_router,
+    metrics_router,
+    progress_router,
+    responses_router,
+)
+from .routers.guests import backfill_name_keys
+from .routers.progress import (
+    ensure_aggregates,
+    progress_log,
+    rebuild_analytics,
+)
+from .snapshot import snapshot
 
-from .database import create_db_and_tables
-from .routers import auth_router, guests_router, progress_router, responses_router
+
+def prepare() -> None:
+    """Startup work done once per run, before any process serves requests"""
+
+    _ = migrate()
+    with Session(get_engine()) as session:
+        backfill_name_keys(session)
+        ensure_aggregates(session)
+    _ = progress_log.replay()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):  # pyright: ignore[reportUnusedParameter]
-    create_db_and_tables()
+    # app.serve runs prepare() in the parent before starting workers
+    if os.getenv("APP_PREPARED") != "1":
+        prepare()
     _ = load_dotenv()
+    bus.start()
+    with Session(get_engine()) as session:
+        rebuild_analytics(session)
+    progress_log.start()
+    snapshot.start()
     yield
+    await snapshot.stop()
+    await progress_log.stop()
+    await bus.stop()
+    await dispose_async_engines()
 
 
 app: FastAPI = FastAPI(
@@ -33,7 +73,8 @@ app.add_middleware(
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["Authorization", "Content-Type"],
+    allow_headers=["Authorization", "Content-Type", "If-None-Match", "Idempotency-Key"],
+    expose_headers=["ETag", "Link", "X-Next-Cursor", "Idempotent-Replayed"],
 )
 
 app.add_middleware(
@@ -43,7 +84,12 @@ app.add_middleware(
 
 # app.add_middleware(HTTPSRedirectMiddleware)
 
+# Added last so it is outermost and times the whole middleware stack
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(auth_router, prefix="/auth", tags=["Auth"])
 app.include_router(guests_router, prefix="/guests", tags=["Guests"])
 app.include_router(responses_router, prefix="/responses", tags=["Responses"])
 app.include_router(progress_router, prefix="/progress", tags=["Progress"])
+app.include_router(feed_router, prefix="/feed", tags=["Feed"])
+app.include_router(metrics_router)
@@ -0,0 +1,307 @@
+"""metrics.py - request, database and password metrics in Prometheus text format
+
+Metrics are plain counters under a lock, rendered on demand by /metrics, so
+recording on the hot path is a dict lookup and a few additions.
+"""
+
+import bisect
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterable
+from contextvars import ContextVar
+from typing import Any
+
+from sqlalchemy import Engine, event
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+Labels = tuple[str, ...]
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: Labels, values: Labels) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Labels = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    @abstractmethod
+    def render(self) -> list[str]: ...
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Labels = ()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [
+            f"{self.name}{format_labels(self.labelnames, labels)} {value}"
+            for labels, value in values
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+class CallbackGauge(Metric):
+    """Gauge read from a callback at render time, for state kept elsewhere"""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Labels,
+        collect: Callable[[], Iterable[tuple[Labels, float]]],
+    ):
+        super().__init__(name, help, labelnames)
+        self.collect = collect
+
+    def render(self) -> list[str]:
+        return self.header() + [
+            f"{self.name}{format_labels(self.labelnames, labels)} {value}"
+            for labels, value in self.collect()
+        ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Labels = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = buckets
+        # Per label set: a count per bucket (plus +Inf), then the sum
+        self._values: dict[Labels, list[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = sorted(
+                (labels, list(counts)) for labels, counts in self._values.items()
+            )
+
+        lines = self.header()
+        for labels, counts in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                bucket_labels = format_labels(
+                    (*self.labelnames, "le"), (*labels, str(bound))
+                )
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            label_text = format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {counts[-1]}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Any:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_latency: Histogram = registry.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Request latency by route and status",
+        ("method", "route", "status"),
+    )
+)
+requests_in_flight: Gauge = registry.register(
+    Gauge("http_requests_in_flight", "Requests currently being handled", ("method",))
+)
+request_queries: Histogram = registry.register(
+    Histogram(
+        "http_request_db_queries",
+        "Database statements executed per request",
+        ("method", "route"),
+        buckets=COUNT_BUCKETS,
+    )
+)
+request_query_time: Histogram = registry.register(
+    Histogram(
+        "http_request_db_duration_seconds",
+        "Time spent in database statements per request",
+        ("method", "route"),
+    )
+)
+query_latency: Histogram = registry.register(
+    Histogram(
+        "db_query_duration_seconds",
+        "Database statement latency by engine and operation",
+        ("engine", "operation"),
+        buckets=QUERY_BUCKETS,
+    )
+)
+argon2_latency: Histogram = registry.register(
+    Histogram(
+        "argon2_duration_seconds",
+        "Time spent hashing or verifying passwords",
+        ("operation",),
+    )
+)
+requests_coalesced: Counter = registry.register(
+    Counter(
+        "http_requests_coalesced_total",
+        "Requests served by joining an identical computation already in flight",
+        ("name",),
+    )
+)
+requests_shed: Counter = registry.register(
+    Counter(
+        "http_requests_shed_total",
+        "Write requests refused by admission control, by route and reason",
+        ("route", "reason"),
+    )
+)
+
+
+class RequestStats:
+    __slots__ = ("queries", "query_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+
+
+# Set per request by the middleware and read by the engine hooks; contextvars
+# follow requests into SQLAlchemy's greenlets and asyncio.to_thread workers.
+current_request: ContextVar[RequestStats | None] = ContextVar(
+    "current_request", default=None
+)
+
+
+def instrument_engine(engine: Engine, name: str) -> None:
+    """Time every statement on `engine` and charge it to the current request"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(  # pyright: ignore[reportUnusedFunction]
+        conn: Any, cursor: Any, statement: str, *args: Any
+    ) -> None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(  # pyright: ignore[reportUnusedFunction]
+        conn: Any, cursor: Any, statement: str, *args: Any
+    ) -> None:
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        operation = statement.split(None, 1)[0].upper()
+        query_latency.observe(elapsed, name, operation)
+
+        stats = current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.query_time += elapsed
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording latency, in-flight requests and DB use"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._routes: dict[Any, str] = {}
+
+    def route_path(self, scope: Scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+
+        path = self._routes.get(endpoint)
+        if path is None:
+            for route in scope["app"].routes:
+                if getattr(route, "endpoint", None) is endpoint:
+                    path = self._routes[endpoint] = route.path
+                    break
+            else:
+                return "unmatched"
+        return path
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method: str = scope["method"]
+        status = "500"
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        requests_in_flight.inc(method)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            requests_in_flight.dec(method)
+            current_request.reset(token)
+
+            route = self.route_path(scope)
+            request_latency.observe(elapsed, method, route, status)
+            request_queries.observe(stats.queries, method, route)
+            request_query_time.observe(stats.query_time, method, route)
@@ -0,0 +1,217 @@
+"""migrations.py - versioned schema changes tracked in PRAGMA user_version
+
+Migrations run in order inside one BEGIN IMMEDIATE transaction, so several
+processes starting at once apply each one exactly once. A fresh database gets
+the current models from the baseline, so later migrations must be idempotent
+(IF NOT EXISTS, checkfirst) against a schema that already has their changes.
+"""
+
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from sqlalchemy import ClauseElement, Connection, Engine, text
+from sqlalchemy.schema import CreateColumn, CreateIndex, CreateTable
+from sqlmodel import Session, SQLModel, col, delete, func, select
+
+from .database import get_engine
+
+# Imported so every table is registered on SQLModel.metadata before migrating
+from .idempotency import IdempotencyKey
+from .progress_log import ProgressLogSegment  # pyright: ignore[reportUnusedImport]
+from .rollup import GROUP_STATS, GuestGroupCount, rebuild_group_counts
+from .routers.auth import User
+from .routers.guests import GUEST_SELECT, Guest
+from .routers.progress import AGGREGATE_TOTALS, Progress, ProgressAggregate
+from .routers.responses import Response
+
+
+@dataclass
+class Migration:
+    version: int
+    description: str
+    apply: Callable[[Connection], None]
+
+
+def add_missing_columns(connection: Connection) -> None:
+    """Add columns (and their indexes) that models gained after a table was created"""
+
+    for table in SQLModel.metadata.sorted_tables:
+        existing = {
+            row[1]
+            for row in connection.exec_driver_sql(f'PRAGMA table_info("{table.name}")')
+        }
+        added = [column for column in table.columns if column.name not in existing]
+        for column in added:
+            ddl = CreateColumn(column).compile(dialect=connection.dialect)
+            _ = connection.exec_driver_sql(
+                f'ALTER TABLE "{table.name}" ADD COLUMN {ddl}'
+            )
+        if added:
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+
+
+def baseline(connection: Connection) -> None:
+    SQLModel.metadata.create_all(connection)
+    add_missing_columns(connection)
+
+
+def add_query_indexes(connection: Connection) -> None:
+    for statement in (
+        "CREATE INDEX IF NOT EXISTS ix_guest_response_id ON guest (response_id)",
+        "CREATE INDEX IF NOT EXISTS ix_response_active ON response (active)",
+        "CREATE INDEX IF NOT EXISTS ix_progress_headline_timestamp"
+        " ON progress (headline, timestamp)",
+        # A prefix of the composite index above
+        "DROP INDEX IF EXISTS ix_progress_headline",
+        "ANALYZE",
+    ):
+        _ = connection.exec_driver_sql(statement)
+
+
+def add_idempotency_keys(connection: Connection) -> None:
+    IdempotencyKey.__table__.create(  # pyright: ignore[reportAttributeAccessIssue]
+        connection, checkfirst=True
+    )
+
+
+def add_guest_group_counts(connection: Connection) -> None:
+    GuestGroupCount.__table__.create(  # pyright: ignore[reportAttributeAccessIssue]
+        connection, checkfirst=True
+    )
+    with Session(bind=connection) as session:
+        rebuild_group_counts(session)
+
+
+MIGRATIONS = [
+    Migration(1, "Tables created by create_all before migrations", baseline),
+    Migration(
+        2, "Indexes for the guest join, active filter and aggregates", add_query_indexes
+    ),
+    Migration(
+        3, "Responses stored under Idempotency-Key for retries", add_idempotency_keys
+    ),
+    Migration(4, "Per-group RSVP counts for /guests/summary", add_guest_group_counts),
+    Migration(5, "Server arrival time on progress events", add_missing_columns),
+]
+
+
+def schema_version(connection: Connection) -> int:
+    return connection.exec_driver_sql("PRAGMA user_version").scalar_one()
+
+
+def migrate(engine: Engine | None = None) -> list[Migration]:
+    """Apply pending migrations and return the ones that ran"""
+
+    with (engine or get_engine()).connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        # pysqlite doesn't wrap DDL in transactions itself, so take the write
+        # lock explicitly before reading the version.
+        _ = connection.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            version = schema_version(connection)
+            pending = [m for m in MIGRATIONS if m.version > version]
+            for migration in pending:
+                migration.apply(connection)
+                _ = connection.exec_driver_sql(
+                    f"PRAGMA user_version = {migration.version}"
+                )
+            _ = connection.exec_driver_sql("COMMIT")
+        except BaseException:
+            _ = connection.exec_driver_sql("ROLLBACK")
+            raise
+
+    return pending
+
+
+def query_shapes() -> dict[str, ClauseElement]:
+    """The statements the routers run, with sample parameters"""
+
+    return {
+        "guests.list": text(
+            GUEST_SELECT + " WHERE g.guest_id > 0 ORDER BY g.guest_id LIMIT 51"
+        ),
+        "guests.get": text(GUEST_SELECT + " WHERE g.guest_id = 1"),
+        "guests.link_by_name": text(
+            "UPDATE Guest SET response_id = 1 WHERE name_key = 'anna'"
+        ),
+        "guests.unlink_all": text(
+            "UPDATE Guest SET response_id = NULL WHERE response_id IS NOT NULL"
+        ),
+        "guests.snapshot": select(
+            func.count(), func.count(col(Guest.response_id))
+        ).where(col(Guest.active) == True),
+        "responses.list": select(Response)
+        .where(col(Response.active) == True)
+        .where(col(Response.response_id) > 0)
+        .order_by(col(Response.response_id))
+        .limit(51),
+        "responses.snapshot": select(
+            func.count(), func.count().filter(col(Response.rsvp) == True)
+        ).where(col(Response.active) == True),
+        "progress.page": select(Progress)
+        .where(col(Progress.progress_id) > 0)
+        .order_by(col(Progress.progress_id))
+        .limit(101),
+        "progress.aggregates": AGGREGATE_TOTALS,
+        "progress.analytics": select(
+            Progress.headline, Progress.timestamp, Progress.received
+        ),
+        "progress.stats": select(ProgressAggregate).order_by(
+            col(ProgressAggregate.amount).desc()
+        ),
+        "guests.summary": select(GuestGroupCount)
+        .where(col(GuestGroupCount.amount) != 0)
+        .order_by(col(GuestGroupCount.group), col(GuestGroupCount.stat)),
+        "guests.group_stats": text(
+            GROUP_STATS.format(guests="AND g.guest_id IN (1, 2, 3)")
+        ),
+        "auth.login": select(User).where(User.username == "bench"),
+        "idempotency.lookup": select(IdempotencyKey).where(
+            IdempotencyKey.key == "POST /responses/ key",
+            col(IdempotencyKey.created) > 0,
+        ),
+        "idempotency.prune": delete(IdempotencyKey).where(
+            col(IdempotencyKey.created) <= 0
+        ),
+    }
+
+
+def explain_query_plans(connection: Connection) -> dict[str, list[str]]:
+    """EXPLAIN QUERY PLAN for every router query, full table scans marked"""
+
+    report: dict[str, list[str]] = {}
+    for name, statement in query_shapes().items():
+        sql = str(
+            statement.compile(
+                dialect=connection.dialect, compile_kwargs={"literal_binds": True}
+            )
+        )
+        depth: dict[int, int] = {0: 0}
+        lines: list[str] = []
+        for node, parent, _, detail in connection.exec_driver_sql(
+            f"EXPLAIN QUERY PLAN {sql}"
+        ):
+            depth[node] = depth.get(parent, 0) + 1
+            full_scan = detail.startswith("SCAN") and " USING " not in detail
+            lines.append(
+                "  " * (depth[node] - 1)
+                + detail
+                + ("  <- full scan" if full_scan else "")
+            )
+        report[name] = lines
+    return report
+
+
+def schema_sql() -> str:
+    """DDL for the current models, as the migrations leave a fresh database"""
+
+    dialect = get_engine().dialect
+    statements: list[str] = []
+    for table in SQLModel.metadata.sorted_tables:
+        statements.append(str(CreateTable(table).compile(dialect=dialect)).strip())
+        for index in sorted(table.indexes, key=lambda index: index.name or ""):
+            statements.append(str(CreateIndex(index).compile(dialect=dialect)).strip())
+    # CreateTable leaves a trailing space after each column's comma
+    ddl = ";\n\n".join(statements) + ";\n"
+    return "\n".join(line.rstrip() for line in ddl.split("\n"))
@@ -0,0 +1,77 @@
+import base64
+from collections.abc import Callable, Sequence
+from dataclasses import dataclass
+from typing import Annotated, Any
+
+from fastapi import Depends, HTTPException, Query
+
+MAX_PAGE_SIZE = 1000
+
+
+@dataclass
+class PageParams:
+    limit: int | None
+    after: int | None
+    fields: set[str] | None
+
+    @property
+    def paginated(self) -> bool:
+        return self.limit is not None or self.after is not None
+
+
+@dataclass
+class Page:
+    items: Sequence[Any]
+    next_cursor: str | None
+
+
+def encode_cursor(key: int) -> str:
+    return base64.urlsafe_b64encode(str(key).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def page_params(
+    limit: Annotated[int | None, Query(ge=1, le=MAX_PAGE_SIZE)] = None,
+    cursor: str | None = None,
+    fields: str | None = None,
+) -> PageParams:
+    """Keyset pagination and sparse fieldsets for list endpoints
+
+    Without limit or cursor a list endpoint returns every row as before. With
+    them, rows are ordered by primary key and the cursor for the next page is
+    returned in the X-Next-Cursor and Link headers.
+    """
+
+    return PageParams(
+        limit=limit,
+        after=decode_cursor(cursor) if cursor is not None else None,
+        fields=(
+            {field.strip() for field in fields.split(",") if field.strip()}
+            if fields
+            else None
+        ),
+    )
+
+
+def paginate(
+    rows: Sequence[Any], params: PageParams, key: Callable[[Any], int]
+) -> Page | Sequence[Any]:
+    """Trim a limit + 1 row fetch to one page and derive the next cursor"""
+
+    if not params.paginated:
+        return rows
+    if params.limit is None or len(rows) <= params.limit:
+        return Page(rows, None)
+
+    rows = rows[: params.limit]
+    return Page(rows, encode_cursor(key(rows[-1])))
+
+
+PageDep: Annotated[PageParams, Depends(page_params)] = Depends(page_params)
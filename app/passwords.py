@@ -0,0 +1,235 @@
+import asyncio
+import json
+import os
+import re
+import statistics
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, fields, replace
+from typing import Any, TypeVar
+
+from fastapi import HTTPException
+from passlib.hash import argon2
+
+from .metrics import argon2_latency
+
+T = TypeVar("T")
+
+PARAMS_FILE = os.getenv("ARGON2_PARAMS_FILE", "db_data/argon2.json")
+# Calibration keeps at least 8 MiB; with less a hash stops costing an
+# attacker's GPU much more than our CPU
+MIN_MEMORY_COST = 8 * 1024
+MAX_TIME_COST = 20
+# $argon2id$v=19$m=65536,t=3,p=4$<salt>$<digest>
+HASH_PARAMS = re.compile(r"\$argon2id\$v=19\$m=(\d+),t=(\d+),p=(\d+)\$")
+
+
+@dataclass
+class Argon2Params:
+    time_cost: int
+    memory_cost: int  # KiB
+    parallelism: int
+
+
+def load_params(path: str = PARAMS_FILE) -> Argon2Params:
+    """passlib's defaults, overridden by the calibration file, then the env"""
+
+    params = Argon2Params(
+        time_cost=argon2.default_rounds,
+        memory_cost=argon2.memory_cost,
+        parallelism=argon2.parallelism,
+    )
+    try:
+        with open(path) as f:
+            saved: dict[str, Any] = json.load(f)
+    except FileNotFoundError:
+        saved = {}
+
+    for field in fields(params):
+        value = os.getenv(f"ARGON2_{field.name.upper()}") or saved.get(field.name)
+        if value:
+            params = replace(params, **{field.name: int(value)})
+    return params
+
+
+def hasher_for(params: Argon2Params) -> type[argon2]:
+    return argon2.using(  # pyright: ignore[reportUnknownMemberType]
+        rounds=params.time_cost,
+        memory_cost=params.memory_cost,
+        parallelism=params.parallelism,
+    )
+
+
+argon2_params = load_params()
+hasher = hasher_for(argon2_params)
+
+
+def hash_params(hashed_password: str) -> Argon2Params | None:
+    """The parameters a stored argon2id hash was made with, None if not one"""
+
+    match = HASH_PARAMS.match(hashed_password)
+    if match is None:
+        return None
+    memory_cost, time_cost, parallelism = map(int, match.groups())
+    return Argon2Params(time_cost, memory_cost, parallelism)
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    start = time.perf_counter()
+    try:
+        return argon2.verify(  # pyright: ignore[reportUnknownMemberType, reportUnknownVariableType]
+            plain_password, hashed_password
+        )
+    finally:
+        argon2_latency.observe(time.perf_counter() - start, "verify")
+
+
+def get_password_hash(password: str) -> str:
+    start = time.perf_counter()
+    try:
+        return hasher.hash(  # pyright: ignore[reportUnknownMemberType, reportUnknownVariableType]
+            password
+        )
+    finally:
+        argon2_latency.observe(time.perf_counter() - start, "hash")
+
+
+def verify_and_update(
+    plain_password: str, hashed_password: str
+) -> tuple[bool, str | None]:
+    """Verify, and rehash with the current parameters if the hash predates them"""
+
+    if not verify_password(plain_password, hashed_password):
+        return False, None
+    # passlib's needs_update ignores parallelism, so every cost is compared
+    if hash_params(hashed_password) == argon2_params:
+        return True, None
+    return True, get_password_hash(plain_password)
+
+
+def measure(params: Argon2Params, samples: int = 3) -> float:
+    """Median seconds one verify takes with these parameters on this host"""
+
+    sample = hasher_for(params)
+    hashed = sample.hash("calibration")  # pyright: ignore[reportUnknownMemberType]
+    timings: list[float] = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        _ = sample.verify(  # pyright: ignore[reportUnknownMemberType]
+            "calibration", hashed
+        )
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def calibrate(
+    target: float, max_memory_cost: int, parallelism: int
+) -> tuple[Argon2Params, float]:
+    """The costliest parameters whose verify stays within `target` seconds here
+
+    Memory is what makes guessing expensive on GPUs, so it stays at
+    max_memory_cost unless a single pass is already too slow, and passes are
+    then added while verify fits the target.
+    """
+
+    params = Argon2Params(1, max_memory_cost, parallelism)
+    elapsed = measure(params)
+    while elapsed > target and params.memory_cost // 2 >= MIN_MEMORY_COST:
+        params = replace(params, memory_cost=params.memory_cost // 2)
+        elapsed = measure(params)
+
+    while params.time_cost < MAX_TIME_COST:
+        candidate = replace(params, time_cost=params.time_cost + 1)
+        candidate_elapsed = measure(candidate)
+        if candidate_elapsed > target:
+            break
+        params, elapsed = candidate, candidate_elapsed
+    return params, elapsed
+
+
+def save_params(params: Argon2Params, path: str = PARAMS_FILE, **extra: Any) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(asdict(params) | extra, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+class PasswordPoolFull(Exception):
+    pass
+
+
+class PasswordPool:
+    """Bounded executor for argon2 work
+
+    argon2-cffi releases the GIL while hashing, so threads run hashes in
+    parallel without blocking the event loop. At most `workers` hashes run at
+    once and at most `queue_limit` more wait; anything beyond that is refused
+    instead of piling up behind the CPU.
+    """
+
+    def __init__(self, workers: int, queue_limit: int):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="argon2"
+        )
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.rejected = 0
+        self.rehashed = 0
+
+    def submit(self, fn: Callable[..., T], *args: str) -> "Future[T]":
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordPoolFull()
+
+        with self._lock:
+            self.pending += 1
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, _: "Future[Any]") -> None:
+        with self._lock:
+            self.pending -= 1
+        self._slots.release()
+
+    async def run(self, fn: Callable[..., T], *args: str) -> T:
+        try:
+            future = self.submit(fn, *args)
+        except PasswordPoolFull:
+            raise HTTPException(
+                status_code=503,
+                detail="Too many password operations in progress",
+                headers={"Retry-After": "1"},
+            )
+        return await asyncio.wrap_future(future)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self.run(verify_password, plain_password, hashed_password)
+
+    async def verify_and_update(
+        self, plain_password: str, hashed_password: str
+    ) -> tuple[bool, str | None]:
+        verified, new_hash = await self.run(
+            verify_and_update, plain_password, hashed_password
+        )
+        if new_hash is not None:
+            self.rehashed += 1
+        return verified, new_hash
+
+    async def hash(self, password: str) -> str:
+        return await self.run(get_password_hash, password)
+
+    def hash_sync(self, password: str) -> str:
+        return self.submit(get_password_hash, password).result()
+
+
+password_pool = PasswordPool(
+    workers=int(os.getenv("PASSWORD_WORKERS", str(min(4, os.cpu_count() or 1)))),
+    queue_limit=int(os.getenv("PASSWORD_QUEUE_LIMIT", "16")),
+)
@@ -0,0 +1,297 @@
+"""progress_log.py - segmented append-only log for progress events
+
+Events are appended as JSON lines to the current segment file. A background
+task seals the segment and compacts all sealed segments into the database in
+one transaction. Every compacted segment is recorded in ProgressLogSegment in
+that same transaction, so a crash between commit and unlink never applies a
+segment twice on replay.
+
+Segment names end in the writing process's pid. Worker processes sharing the
+directory compact their own segments and those of processes that have died,
+such as a crashed worker the supervisor replaced; replay() applies everyone's
+and must run before any worker starts appending. A segment is applied under
+an exclusive flock, so two workers never apply the same one.
+
+purge() deletes the stored events and drops the unapplied ones in the same
+transaction, so a later compaction can't bring purged events back.
+"""
+
+import asyncio
+import fcntl
+import json
+import os
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import IO, Any
+
+from sqlalchemy import Engine
+from sqlmodel import Field  # pyright: ignore[reportUnknownVariableType]
+from sqlmodel import Session, SQLModel, col, delete, select
+
+from .database import get_engine
+
+Apply = Callable[[Session, list[dict[str, Any]]], None]
+Applied = Callable[[list[dict[str, Any]]], None]
+Clear = Callable[[Session], int]
+
+SEGMENT_SUFFIX = ".log"
+
+
+class ProgressLogSegment(SQLModel, table=True):
+    name: str = Field(primary_key=True)
+
+
+class ProgressLog:
+    def __init__(
+        self,
+        directory: str,
+        apply: Apply,
+        enabled: bool = True,
+        segment_bytes: int = 4 * 1024 * 1024,
+        interval: float = 1.0,
+        fsync: bool = False,
+        engine: Engine | None = None,
+        on_applied: Applied | None = None,
+    ):
+        self.directory = Path(directory)
+        self.apply = apply
+        self.enabled = enabled
+        self.segment_bytes = segment_bytes
+        self.interval = interval
+        self.fsync = fsync
+        self.engine = engine
+        self.on_applied = on_applied
+
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._file: IO[str] | None = None
+        self._path: Path | None = None
+        self._task: asyncio.Task[None] | None = None
+
+    def append(self, event: dict[str, Any]) -> None:
+        line = json.dumps(event, separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._open_segment()
+            assert self._file is not None
+            _ = self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            if self._file.tell() >= self.segment_bytes:
+                self._seal()
+
+    def seal(self) -> None:
+        with self._lock:
+            self._seal()
+
+    def compact(self) -> int:
+        """Seal the current segment and apply every sealed one to the database"""
+
+        self.seal()
+        with self._compact_lock:
+            return self._apply_segments(self._sealed_segments(every_process=False))
+
+    def replay(self) -> int:
+        """Apply segments left on disk by previous processes"""
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.seal()
+        with self._compact_lock:
+            return self._apply_segments(self._sealed_segments(every_process=True))
+
+    def purge(self, clear: Clear) -> int:
+        """Run `clear` and drop the sealed segments unapplied; returns its result
+
+        Only this process's segments and those of dead processes are dropped;
+        other workers discard() theirs when they hear of the purge.
+        """
+
+        self.seal()
+        with self._compact_lock:
+            segments = self._sealed_segments(every_process=False)
+            return self._drop_segments(segments, clear)
+
+    def discard(self) -> None:
+        """Seal the current segment and drop every sealed one unapplied"""
+
+        self.seal()
+        with self._compact_lock:
+            _ = self._drop_segments(self._sealed_segments(every_process=False))
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            _ = await asyncio.to_thread(self.compact)
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            _ = self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        _ = await asyncio.to_thread(self.compact)
+
+    def _open_segment(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        name = f"{time.time_ns():020d}-{os.getpid()}{SEGMENT_SUFFIX}"
+        self._path = self.directory / name
+        self._file = open(self._path, "a", encoding="utf-8")
+
+    def _seal(self) -> None:
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+            self._file.close()
+        self._file = None
+        self._path = None
+
+    def _sealed_segments(self, every_process: bool) -> list[Path]:
+        if not self.directory.exists():
+            return []
+        with self._lock:
+            current = self._path
+        pid = os.getpid()
+        return sorted(
+            path
+            for path in self.directory.glob(f"*{SEGMENT_SUFFIX}")
+            if path != current
+            and (every_process or segment_pid(path) == pid or not alive(path))
+        )
+
+    def _apply_segments(self, segments: list[Path]) -> int:
+        claimed = claim_segments(segments)
+        try:
+            return self._apply_claimed([path for path, _ in claimed])
+        finally:
+            for _, fd in claimed:
+                os.close(fd)
+
+    def _apply_claimed(self, segments: list[Path]) -> int:
+        if not segments:
+            return 0
+
+        names = [path.name for path in segments]
+        applied = 0
+        with Session(self.engine or get_engine()) as session:
+            done = set(
+                session.exec(
+                    select(ProgressLogSegment.name).where(
+                        col(ProgressLogSegment.name).in_(names)
+                    )
+                ).all()
+            )
+            events: list[dict[str, Any]] = []
+            for path in segments:
+                if path.name not in done:
+                    events.extend(read_segment(path))
+                    session.add(ProgressLogSegment(name=path.name))
+            if events:
+                self.apply(session, events)
+                applied = len(events)
+            session.commit()
+            if events and self.on_applied is not None:
+                self.on_applied(events)
+
+            self._forget(session, segments)
+
+        return applied
+
+    def _drop_segments(self, segments: list[Path], clear: Clear | None = None) -> int:
+        claimed = claim_segments(segments)
+        try:
+            with Session(self.engine or get_engine()) as session:
+                cleared = clear(session) if clear is not None else 0
+                # Recorded like applied segments, so a crash before the unlinks
+                # doesn't apply them on replay
+                names = [path.name for path, _ in claimed]
+                done = set(
+                    session.exec(
+                        select(ProgressLogSegment.name).where(
+                            col(ProgressLogSegment.name).in_(names)
+                        )
+                    ).all()
+                )
+                session.add_all(
+                    ProgressLogSegment(name=name) for name in names if name not in done
+                )
+                session.commit()
+                self._forget(session, [path for path, _ in claimed])
+            return cleared
+        finally:
+            for _, fd in claimed:
+                os.close(fd)
+
+    def _forget(self, session: Session, segments: list[Path]) -> None:
+        for path in segments:
+            path.unlink(missing_ok=True)
+        _ = session.execute(
+            delete(ProgressLogSegment).where(
+                col(ProgressLogSegment.name).in_([path.name for path in segments])
+            )
+        )
+        session.commit()
+
+
+def segment_pid(path: Path) -> int | None:
+    try:
+        return int(path.stem.rsplit("-", 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def alive(path: Path) -> bool:
+    """Whether the process that wrote this segment is still running"""
+
+    pid = segment_pid(path)
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def claim_segments(segments: list[Path]) -> list[tuple[Path, int]]:
+    """Lock the segments no other process is applying; closing the fd releases"""
+
+    claimed: list[tuple[Path, int]] = []
+    for path in segments:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            continue
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # Another process may have applied and unlinked it before we locked
+            if os.stat(path).st_ino != os.fstat(fd).st_ino:
+                raise FileNotFoundError(path)
+        except (BlockingIOError, FileNotFoundError):
+            os.close(fd)
+            continue
+        claimed.append((path, fd))
+    return claimed
+
+
+def read_segment(path: Path) -> list[dict[str, Any]]:
+    events: list[dict[str, Any]] = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            # A crash mid-append leaves a torn last line; skip it.
+            if not line.endswith("\n"):
+                break
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return events
@@ -0,0 +1,155 @@
+"""rollup.py - per-group RSVP counts kept up to date by the write paths
+
+GuestGroupCount holds one row per group and stat: invited, responded,
+attending, declined and diet:<diet> for attending guests' diets. Only active
+guests count, and only active responses count as responded.
+
+Writes that can change a guest's counts subtract those guests' counts before
+the change and add them back after it, in the same transaction, so the rollup
+costs as much as the rows touched. verify_group_counts() compares the table
+against a full recompute.
+"""
+
+from collections.abc import AsyncIterator, Sequence
+from contextlib import asynccontextmanager
+
+from sqlalchemy import TextClause, bindparam, delete, text
+from sqlalchemy.orm import Session
+from sqlmodel import Field  # pyright: ignore[reportUnknownVariableType]
+from sqlmodel import SQLModel, col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+# Keeps IN lists under SQLite's bound parameter limit
+CHUNK_SIZE = 500
+
+# (group, stat, amount) for active guests, narrowed by {guests}
+GROUP_STATS = """
+    WITH member AS (
+        SELECT g."group", r.response_id IS NOT NULL AS responded, r.rsvp,
+            TRIM(COALESCE(r.diet, '')) AS diet
+        FROM guest AS g
+        LEFT JOIN response AS r ON g.response_id = r.response_id AND r.active
+        WHERE COALESCE(g.active, TRUE) {guests}
+    )
+    SELECT "group", 'invited' AS stat, count(*) AS amount FROM member GROUP BY 1
+    UNION ALL
+    SELECT "group", 'responded', count(*) FROM member WHERE responded GROUP BY 1
+    UNION ALL
+    SELECT "group", 'attending', count(*) FROM member
+    WHERE responded AND rsvp GROUP BY 1
+    UNION ALL
+    SELECT "group", 'declined', count(*) FROM member
+    WHERE responded AND NOT rsvp GROUP BY 1
+    UNION ALL
+    SELECT "group", 'diet:' || diet, count(*) FROM member
+    WHERE responded AND rsvp AND diet != '' GROUP BY 1, 2
+"""
+
+# WHERE TRUE keeps SQLite from reading ON CONFLICT as a join constraint
+SHIFT_COUNTS = """
+    INSERT INTO guestgroupcount ("group", stat, amount)
+    SELECT "group", stat, :sign * amount FROM ({stats}) WHERE TRUE
+    ON CONFLICT ("group", stat) DO UPDATE SET amount = amount + excluded.amount
+"""
+
+
+def shift_query(guests: str) -> TextClause:
+    return text(SHIFT_COUNTS.format(stats=GROUP_STATS.format(guests=guests)))
+
+
+SHIFT_ALL = shift_query("")
+SHIFT_BY_ID = shift_query("AND g.guest_id IN :guest_ids").bindparams(
+    bindparam("guest_ids", expanding=True)
+)
+SHIFT_BY_NAME = shift_query("AND g.name_key = :name_key")
+
+
+class GuestGroupCount(SQLModel, table=True):
+    group: str = Field(primary_key=True)
+    stat: str = Field(primary_key=True)
+    amount: int = Field(default=0)
+
+
+def shift_group_counts(session: Session, guest_ids: Sequence[int], sign: int) -> None:
+    """Add (sign 1) or subtract (sign -1) these guests' current counts"""
+
+    # Rows that drop to zero are left for rebuilds to clear; readers skip them
+    for start in range(0, len(guest_ids), CHUNK_SIZE):
+        chunk = list(guest_ids[start : start + CHUNK_SIZE])
+        _ = session.execute(SHIFT_BY_ID, {"guest_ids": chunk, "sign": sign})
+
+
+def add_group_counts(session: Session, guest_ids: Sequence[int]) -> None:
+    """Count newly inserted guests"""
+
+    shift_group_counts(session, guest_ids, 1)
+
+
+def linked_guests(session: Session, response_ids: Sequence[int]) -> list[int]:
+    """Guests linked to any of these responses"""
+
+    query = text("SELECT guest_id FROM guest WHERE response_id IN :ids").bindparams(
+        bindparam("ids", expanding=True)
+    )
+    guest_ids: list[int] = []
+    for start in range(0, len(response_ids), CHUNK_SIZE):
+        chunk = list(response_ids[start : start + CHUNK_SIZE])
+        guest_ids.extend(session.execute(query, {"ids": chunk}).scalars())
+    return guest_ids
+
+
+@asynccontextmanager
+async def tracking_groups(
+    session: AsyncSession,
+    guest_ids: Sequence[int] = (),
+    name_key: str | None = None,
+) -> AsyncIterator[None]:
+    """Apply the change in these guests' counts made by the enclosed writes
+
+    Guests can be given by id or, saving a lookup, by their name_key.
+    """
+
+    def shift(session: Session, sign: int) -> None:
+        if name_key is not None:
+            params = {"name_key": name_key, "sign": sign}
+            _ = session.execute(SHIFT_BY_NAME, params)
+        shift_group_counts(session, guest_ids, sign)
+
+    await session.run_sync(shift, -1)
+    yield
+    await session.flush()
+    await session.run_sync(shift, 1)
+
+
+def rebuild_group_counts(session: Session) -> None:
+    _ = session.execute(delete(GuestGroupCount))
+    _ = session.execute(SHIFT_ALL, {"sign": 1})
+
+
+def verify_group_counts(session: Session) -> list[str]:
+    """Compare the rollup against a full recompute from guests and responses"""
+
+    stored: dict[tuple[str, str], int] = {
+        (group, stat): amount
+        for group, stat, amount in session.execute(
+            select(
+                GuestGroupCount.group, GuestGroupCount.stat, GuestGroupCount.amount
+            ).where(col(GuestGroupCount.amount) != 0)
+        ).all()
+    }
+    actual: dict[tuple[str, str], int] = {
+        (group, stat): amount
+        for group, stat, amount in session.execute(
+            text(GROUP_STATS.format(guests=""))
+        ).all()
+    }
+
+    mismatches: list[str] = []
+    for key in sorted(stored.keys() | actual.keys()):
+        if stored.get(key) != actual.get(key):
+            group, stat = key
+            mismatches.append(
+                f"{group} {stat}: stored {stored.get(key, 0)},"
+                f" actual {actual.get(key, 0)}"
+            )
+    return mismatches
@@ -1,6 +1,15 @@
 from .auth import router as auth_router
+from .feed import router as feed_router
 from .guests import router as guests_router
+from .metrics import router as metrics_router
 from .progress import router as progress_router
 from .responses import router as responses_router
 
-__all__ = ["progress_router", "guests_router", "responses_router", "auth_router"]
+__all__ = [
+    "progress_router",
+    "guests_router",
+    "responses_router",
+    "auth_router",
+    "feed_router",
+    "metrics_router",
+]
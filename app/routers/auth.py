@@ -1,24 +1,35 @@
+import logging
 import os
 from datetime import datetime, timedelta, timezone
 from typing import Annotated
 
 import jwt
-from dotenv import load_dotenv
 from fastapi import APIRouter, Depends, HTTPException, Response
 from fastapi.security import OAuth2PasswordRequestForm
 from jwt.exceptions import InvalidTokenError
-from passlib.hash import argon2
 from pydantic import BaseModel
+from sqlalchemy import update
 from sqlmodel import Field  # pyright: ignore[reportUnknownVariableType]
-from sqlmodel import Session, SQLModel, select, text
-
-from ..dependencies import AuthDep, SessionDep
+from sqlmodel import Session, SQLModel, col, delete, select, text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ..bulk import BulkResult, affected_rows
+from ..database import get_async_engine
+from ..dependencies import (
+    ALGORITHM,
+    SECRET_KEY,
+    AsyncReadSessionDep,
+    AsyncSessionDep,
+    AuthDep,
+    SessionDep,
+    token_cache,
+)
+from ..passwords import password_pool
 
 router = APIRouter()
 
-_ = load_dotenv()
-SECRET_KEY = os.getenv("SECRET")
-ALGORITHM = "HS256"
+logger = logging.getLogger(__name__)
+
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 
@@ -53,18 +64,6 @@ class Login(BaseModel):
     password: str
 
 
-def verify_password(plain_password: str, hashed_password: str) -> str:
-    return argon2.verify(  # pyright: ignore[reportUnknownMemberType, reportUnknownVariableType]
-        plain_password, hashed_password
-    )
-
-
-def get_password_hash(password: str) -> str:
-    return argon2.hash(  # pyright: ignore[reportUnknownMemberType, reportUnknownVariableType]
-        password
-    )
-
-
 def get_user(username: str) -> User | None:
     session: Annotated[Session, SessionDep] = SessionDep
     user: User | None = session.exec(
@@ -73,10 +72,39 @@ def get_user(username: str) -> User | None:
     return user
 
 
-def authenticate_user(user: User, password: str) -> bool:
-    if not verify_password(password, user.hashed_password):
+async def rehash_password(user: User, new_hash: str) -> None:
+    """Store a hash made with the current argon2 parameters
+
+    Logins read through the read-only engine, so this takes a write session
+    of its own, and only for the first login after the parameters change. It
+    leaves the row alone if the password was changed in the meantime, and a
+    failure only means the next login tries again.
+    """
+
+    try:
+        async with AsyncSession(get_async_engine()) as session:
+            _ = await session.execute(
+                update(User)
+                .where(
+                    col(User.user_id) == user.user_id,
+                    col(User.hashed_password) == user.hashed_password,
+                )
+                .values(hashed_password=new_hash)
+            )
+            await session.commit()
+    except Exception:
+        logger.exception("Rehashing the password of %s failed", user.username)
+
+
+async def authenticate_user(user: User, password: str) -> bool:
+    verified, new_hash = await password_pool.verify_and_update(
+        password, user.hashed_password
+    )
+    if not verified:
         return False
 
+    if new_hash is not None:
+        await rehash_password(user, new_hash)
     return True
 
 
@@ -87,11 +115,7 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=15)
 
-    _ = load_dotenv()
-    SECRET_KEY = os.getenv("SECRET")
-
     to_encode.update({"exp": expire})
-    print("secret", SECRET_KEY)
     encoded_jwt: str = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
     return encoded_jwt
@@ -100,15 +124,17 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
 @router.post("/login/")
 async def login_json(
     login_data: Login,
-    session: Annotated[Session, SessionDep],
+    session: Annotated[AsyncSession, AsyncReadSessionDep],
     #response: Response
 ) -> Token:
     username = login_data.username
     password = login_data.password
 
-    user = session.exec(select(User).where(User.username == username)).one_or_none()
+    user = (
+        await session.exec(select(User).where(User.username == username))
+    ).one_or_none()
 
-    if not user or not authenticate_user(user, password):
+    if not user or not await authenticate_user(user, password):
         raise HTTPException(
             status_code=400,
             detail="Incorrect username or password",
@@ -164,14 +190,16 @@ async def get_current_active_user(
 @router.post("/token")
 async def login(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-    session: Annotated[Session, SessionDep],
+    session: Annotated[AsyncSession, AsyncReadSessionDep],
 ) -> Token:
     username = form_data.username
     password = form_data.password
 
-    user = session.exec(select(User).where(User.username == username)).one_or_none()
+    user = (
+        await session.exec(select(User).where(User.username == username))
+    ).one_or_none()
 
-    if not user or not authenticate_user(user, password):
+    if not user or not await authenticate_user(user, password):
         raise HTTPException(
             status_code=400,
             detail="Incorrect username or password",
@@ -187,19 +215,20 @@ async def login(
 
 
 @router.post("/users", response_model=PublicUser)
-def create_user(
+async def create_user(
     userData: CreateUser,
-    session: Annotated[Session, SessionDep],
+    session: Annotated[AsyncSession, AsyncSessionDep],
     _: Annotated[str, AuthDep],
 ):
     user = User(
-        username=userData.username, hashed_password=get_password_hash(userData.password)
+        username=userData.username,
+        hashed_password=await password_pool.hash(userData.password),
     )
 
     db_user = User.model_validate(user)
     session.add(db_user)
-    session.commit()
-    session.refresh(db_user)
+    await session.commit()
+    await session.refresh(db_user)
     return db_user
 
 
@@ -207,37 +236,42 @@ def create_user(
     "/users",
     response_model=PublicUser,
 )
-def update_user(
+async def update_user(
     userData: CreateUser,
-    session: Annotated[Session, SessionDep],
+    session: Annotated[AsyncSession, AsyncSessionDep],
     _: Annotated[str, AuthDep],
 ):
-    user: User | None = session.exec(
-        select(User).where(User.username == userData.username)
+    user: User | None = (
+        await session.exec(select(User).where(User.username == userData.username))
     ).one_or_none()
 
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    user_data = userData.model_dump(exclude_unset=True)
-    _ = user.sqlmodel_update(user_data)
+    user.hashed_password = await password_pool.hash(userData.password)
 
     session.add(user)
-    session.commit()
-    session.refresh(user)
+    await session.commit()
+    await session.refresh(user)
 
     return user
 
 
-@router.delete("/users")
-def delete_all(
-    session: Annotated[Session, SessionDep], passkey: str, _: Annotated[str, AuthDep]
+@router.delete("/users", response_model=BulkResult)
+async def delete_all(
+    session: Annotated[AsyncSession, AsyncSessionDep],
+    passkey: str,
+    _: Annotated[str, AuthDep],
 ):
     if passkey != os.getenv("DEL_PSK"):
         raise HTTPException(status_code=403, detail="Forbidden: Invalid passkey")
 
-    users = session.exec(select(User)).all()
-    for user in users:
-        session.delete(user)
+    result = await session.execute(delete(User))
+    await session.commit()
+
+    return BulkResult(affected=affected_rows(result))
+
 
-    session.commit()
+@router.get("/tokens/cache")
+async def read_token_cache(_: Annotated[str, AuthDep]) -> dict[str, int]:
+    return token_cache.stats()
@@ -0,0 +1,106 @@
+import asyncio
+import json
+from typing import Any
+
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from sqlalchemy import func
+from sqlmodel import col, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ..database import get_async_read_engine
+from ..dependencies import decode_token
+from ..feed import Closed, feed
+from .guests import Guest
+from .progress import ProgressAggregate
+from .responses import Response
+
+router = APIRouter()
+
+
+async def build_snapshot() -> dict[str, Any]:
+    """Current counters a dashboard starts from before applying deltas"""
+
+    async with AsyncSession(get_async_read_engine()) as session:
+        progress = (
+            await session.exec(
+                select(ProgressAggregate.headline, ProgressAggregate.amount)
+            )
+        ).all()
+        responses, attending = (
+            await session.exec(
+                select(
+                    func.count(),
+                    func.count().filter(col(Response.rsvp) == True),
+                ).where(col(Response.active) == True)
+            )
+        ).one()
+        guests, linked = (
+            await session.exec(
+                select(
+                    func.count(),
+                    func.count(col(Guest.response_id)),
+                ).where(col(Guest.active) == True)
+            )
+        ).one()
+
+    return {
+        "progress": {headline: amount for headline, amount in progress},
+        "responses": {"total": responses, "attending": attending},
+        "guests": {"total": guests, "linked": linked},
+    }
+
+
+async def wait_disconnect(websocket: WebSocket) -> None:
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
+
+
+@router.websocket("/")
+async def feed_socket(websocket: WebSocket, token: str = ""):
+    """Push a snapshot, then new responses, guest links and progress counts
+
+    Browsers cannot set headers on a WebSocket, so the access token is passed
+    in the query string. Every message carries a sequence number; deltas with
+    a higher seq than the snapshot's were published after it was taken.
+    """
+
+    try:
+        _ = decode_token(token)
+    except Exception:
+        await websocket.close(code=1008, reason="Invalid or expired token")
+        return
+
+    queue = feed.subscribe()
+    if queue is None:
+        await websocket.close(code=1013, reason="Too many subscribers")
+        return
+
+    receiver: asyncio.Task[None] | None = None
+    try:
+        await websocket.accept()
+        seq = feed.seq
+        snapshot = await build_snapshot()
+        await websocket.send_text(
+            json.dumps({"seq": seq, "type": "snapshot", "data": snapshot})
+        )
+
+        receiver = asyncio.create_task(wait_disconnect(websocket))
+        receiver.add_done_callback(lambda _: feed.close(queue))
+        while True:
+            message = await queue.get()
+            if isinstance(message, Closed):
+                break
+            await websocket.send_text(message)
+
+        if not receiver.done():
+            await websocket.close(code=1013, reason="Subscriber too slow")
+
+    except WebSocketDisconnect:
+        pass
+
+    finally:
+        feed.unsubscribe(queue)
+        if receiver is not None:
+            _ = receiver.cancel()
@@ -1,16 +1,37 @@
+import csv
 import datetime
+import io
+import json
 import os
+import tempfile
 from ast import Param
-from typing import Annotated
-
-from fastapi import APIRouter, Header, HTTPException
-from sqlalchemy.orm import selectinload
+from collections.abc import AsyncIterator, Iterator
+from typing import Annotated, Any, Literal
+
+from fastapi import APIRouter, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy import Boolean, DateTime, insert, update
+from sqlalchemy.orm import Session, selectinload
 from sqlmodel import Field  # pyright: ignore[reportUnknownVariableType]
-from sqlmodel import Relationship, Session, SQLModel, column, select, text
+from sqlmodel import Relationship, SQLModel, col, column, delete, select, text
+from sqlmodel.ext.asyncio.session import AsyncSession
 from starlette.types import HTTPExceptionHandler
 
-from ..dependencies import AuthDep, SessionDep
-from .responses import Response
+from ..bulk import BulkResult, affected_rows, patch_values, require_filter
+from ..cache import guests_cache
+from ..coalesce import Coalesced
+from ..database import get_async_read_engine
+from ..dependencies import AsyncReadSessionDep, AsyncSessionDep, AuthDep, CoalesceDep
+from ..feed import feed
+from ..pagination import PageDep, PageParams, paginate
+from ..rollup import (
+    GuestGroupCount,
+    add_group_counts,
+    rebuild_group_counts,
+    tracking_groups,
+)
+from .responses import Response, normalize_name
 
 router = APIRouter()
 
@@ -22,8 +43,11 @@ class GuestBase(SQLModel):
 
 class Guest(GuestBase, table=True):
     guest_id: int | None = Field(primary_key=True, default=None)
-    response_id: int | None = Field(foreign_key="response.response_id", default=None)
+    response_id: int | None = Field(
+        foreign_key="response.response_id", default=None, index=True
+    )
     active: bool | None = Field(default=True)
+    name_key: str | None = Field(default=None, index=True)
 
 
 class GuestPublic(GuestBase):
@@ -42,103 +66,457 @@ class GuestLink(SQLModel):
     response_id: int = Field()
 
 
+class GuestLinkMany(GuestLink):
+    guest_id: int = Field()
+
+
+class GuestLinkResult(SQLModel):
+    linked: int = Field()
+
+
+class GuestPatch(SQLModel):
+    name: str | None = Field(default=None)
+    group: str | None = Field(default=None)
+
+
+class GuestBulk(SQLModel):
+    action: Literal["delete", "restore", "patch"] = Field()
+    guest_ids: list[int] | None = Field(default=None)
+    group: str | None = Field(default=None)
+    patch: GuestPatch | None = Field(default=None)
+
+
+class GuestGroupSummary(SQLModel):
+    group: str = Field()
+    invited: int = Field(default=0)
+    responded: int = Field(default=0)
+    attending: int = Field(default=0)
+    declined: int = Field(default=0)
+    diets: dict[str, int] = Field(default_factory=dict)
+
+
+class GuestImport(SQLModel):
+    imported: int = Field()
+    first_guest_id: int | None = Field(default=None)
+    last_guest_id: int | None = Field(default=None)
+
+
+IMPORT_CHUNK_SIZE = 500
+# Uploads larger than this are spooled to a temporary file
+IMPORT_SPOOL_SIZE = 1 << 20
+EXPORT_BATCH_SIZE = 200
+EXPORT_FIELDS = ["guest_id", "name", "group", "diet", "rsvp", "time"]
+
+# Guests joined with their RSVP, shared by the list, export and detail reads
+GUEST_SELECT = """
+    SELECT g.guest_id, g.name, g.'group', r.diet, COALESCE(rsvp, FALSE) AS rsvp, r.time
+    FROM Guest as g
+    LEFT JOIN Response as r ON g.response_id = r.response_id
+"""
+# Result types for the joined columns, so rows already match GuestPublic
+GUEST_COLUMNS = {"rsvp": Boolean, "time": DateTime}
+
+
+def insert_guests(session: Session, guests: list[GuestCreate]) -> list[int]:
+    if not guests:
+        return []
+
+    result = session.execute(
+        insert(Guest).returning(column("guest_id"), sort_by_parameter_order=True),
+        [
+            guest.model_dump() | {"name_key": normalize_name(guest.name)}
+            for guest in guests
+        ],
+    )
+    guest_ids = list(result.scalars())
+    add_group_counts(session, guest_ids)
+    return guest_ids
+
+
+def backfill_name_keys(session: Session) -> None:
+    guests = session.scalars(select(Guest).where(Guest.name_key == None)).all()
+    for guest in guests:
+        guest.name_key = normalize_name(guest.name)
+        session.add(guest)
+    session.commit()
+
+
+def import_format(request: Request) -> Literal["csv", "ndjson"]:
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("text/csv"):
+        return "csv"
+    if content_type.startswith(("application/x-ndjson", "application/jsonl")):
+        return "ndjson"
+    raise HTTPException(
+        status_code=415, detail="Expected text/csv or application/x-ndjson"
+    )
+
+
+async def spool_body(request: Request) -> "tempfile.SpooledTemporaryFile[bytes]":
+    """Receive the whole upload before the import takes the write connection"""
+
+    spool = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_SIZE)
+    try:
+        async for chunk in request.stream():
+            _ = spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    _ = spool.seek(0)
+    return spool
+
+
+def read_import_rows(
+    format: Literal["csv", "ndjson"], body: io.TextIOBase
+) -> Iterator[tuple[int, dict[str, Any]]]:
+    if format == "csv":
+        # One reader over the whole body, so quoted fields may span lines
+        reader = csv.reader(body)
+        header: list[str] | None = None
+        for values in reader:
+            if not any(value.strip() for value in values):
+                continue
+            if header is None:
+                header = [value.strip() for value in values]
+                continue
+            yield reader.line_num, dict(zip(header, values))
+
+    else:
+        for line_number, line in enumerate(body, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except json.JSONDecodeError:
+                raise HTTPException(
+                    status_code=422, detail=f"Line {line_number}: invalid JSON"
+                )
+
+
 @router.get("/", response_model=list[GuestPublic])
-def read_guests(session: Annotated[Session, SessionDep], _: Annotated[str, AuthDep]):
-    query = text(
-        """
-        SELECT g.guest_id, g.name, g.'group', r.diet, COALESCE(rsvp, FALSE) AS rsvp, r.time
-        FROM Guest as g
-        LEFT JOIN Response as r ON g.response_id = r.response_id;
-    """
+async def read_guests(
+    request: Request,
+    session: Annotated[AsyncSession, AsyncReadSessionDep],
+    page: Annotated[PageParams, PageDep],
+    _: Annotated[str, AuthDep],
+):
+    query = GUEST_SELECT
+    params: dict[str, int] = {}
+    if page.after is not None:
+        query += " WHERE g.guest_id > :after"
+        params["after"] = page.after
+    if page.paginated:
+        query += " ORDER BY g.guest_id"
+    if page.limit is not None:
+        query += " LIMIT :limit"
+        params["limit"] = page.limit + 1
+
+    async def build():
+        rows = (
+            await session.execute(
+                text(query).bindparams(**params).columns(**GUEST_COLUMNS)
+            )
+        ).all()
+        return paginate(rows, page, lambda row: row.guest_id)
+
+    return await guests_cache.respond(
+        request, build, list[GuestPublic], fields=page.fields
     )
-    res: list[GuestPublic] = session.exec(query).all()
-    return res
+
+
+async def export_rows(format: str) -> AsyncIterator[str]:
+    query = text(GUEST_SELECT + " ORDER BY g.guest_id").columns(**GUEST_COLUMNS)
+
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    if format == "csv":
+        writer.writeheader()
+        yield buffer.getvalue()
+        _ = buffer.seek(0)
+        _ = buffer.truncate()
+
+    # Reads the live database: a snapshot can be minutes old, and WAL keeps
+    # this long read from blocking RSVP writes
+    async with get_async_read_engine().connect() as conn:
+        result = await conn.stream(query)
+        async for rows in result.partitions(EXPORT_BATCH_SIZE):
+            for row in rows:
+                guest = GuestPublic.model_validate(row._mapping)
+                if format == "csv":
+                    _ = writer.writerow(guest.model_dump(mode="json"))
+                else:
+                    _ = buffer.write(guest.model_dump_json() + "\n")
+            yield buffer.getvalue()
+            _ = buffer.seek(0)
+            _ = buffer.truncate()
+
+
+@router.get("/export")
+async def export_guests(
+    _: Annotated[str, AuthDep],
+    format: Literal["ndjson", "csv"] = "ndjson",
+):
+    """Stream the guest list row by row as NDJSON or CSV"""
+
+    if format == "csv":
+        return StreamingResponse(
+            export_rows(format),
+            media_type="text/csv",
+            headers={"Content-Disposition": 'attachment; filename="guests.csv"'},
+        )
+
+    return StreamingResponse(export_rows(format), media_type="application/x-ndjson")
+
+
+@router.get("/summary", response_model=list[GuestGroupSummary])
+async def read_guest_summary(
+    request: Request,
+    session: Annotated[AsyncSession, AsyncReadSessionDep],
+    _: Annotated[str, AuthDep],
+):
+    """RSVP counts per group, from the rollup the write paths keep current"""
+
+    async def build():
+        groups: dict[str, dict[str, Any]] = {}
+        rows = await session.exec(
+            select(GuestGroupCount.group, GuestGroupCount.stat, GuestGroupCount.amount)
+            .where(col(GuestGroupCount.amount) != 0)
+            .order_by(col(GuestGroupCount.group), col(GuestGroupCount.stat))
+        )
+        for group, stat, amount in rows.all():
+            counts = groups.setdefault(group, {"group": group, "diets": {}})
+            if stat.startswith("diet:"):
+                counts["diets"][stat.removeprefix("diet:")] = amount
+            else:
+                counts[stat] = amount
+        return [GuestGroupSummary(**counts) for counts in groups.values()]
+
+    return await guests_cache.respond(request, build, list[GuestGroupSummary])
 
 
 @router.get("/{guest_id}", response_model=GuestPublic)
-def read_guest(
-    guest_id: int, session: Annotated[Session, SessionDep], _: Annotated[str, AuthDep]
+async def read_guest(
+    guest_id: int,
+    session: Annotated[AsyncSession, AsyncReadSessionDep],
+    coalesced: Annotated[Coalesced, CoalesceDep],
+    _: Annotated[str, AuthDep],
 ):
-    query = text(
-        """
-        SELECT g.guest_id, g.name, g.'group', r.diet, COALESCE(rsvp, FALSE) AS rsvp, r.time
-        FROM Guest as g
-        LEFT JOIN Response as r ON g.response_id = r.response_id
-        WHERE g.guest_id = :guest_id;
-    """
-    )
-    res: GuestPublic = session.exec(query.bindparams(guest_id=guest_id)).one()
-    return res
+    query = text(GUEST_SELECT + " WHERE g.guest_id = :guest_id")
+
+    async def build():
+        return (await session.execute(query.bindparams(guest_id=guest_id))).one()
+
+    return await coalesced.do(build)
 
 
 @router.post("/", response_model=GuestPublic)
-def create_guest(
+async def create_guest(
     guest: GuestCreate,
-    session: Annotated[Session, SessionDep],
+    session: Annotated[AsyncSession, AsyncSessionDep],
     _: Annotated[str, AuthDep],
 ):
     db_response = Guest.model_validate(guest)
+    db_response.name_key = normalize_name(guest.name)
     session.add(db_response)
-    session.commit()
-    session.refresh(db_response)
+    await session.flush()
+    assert db_response.guest_id is not None
+    await session.run_sync(add_group_counts, [db_response.guest_id])
+    await session.commit()
+    guests_cache.bump()
+    await session.refresh(db_response)
     return db_response
 
 
 @router.post("/many/", response_model=list[GuestPublic])
-def create_guests(
+async def create_guests(
     guests: list[GuestCreate],
-    session: Annotated[Session, SessionDep],
+    session: Annotated[AsyncSession, AsyncSessionDep],
     _: Annotated[str, AuthDep],
 ):
-    for guest in guests:
-        db_response = Guest.model_validate(guest)
-        session.add(db_response)
-        session.commit()
-        session.refresh(db_response)
+    guest_ids = await session.run_sync(insert_guests, guests)
+    await session.commit()
+    guests_cache.bump()
+
+    return [
+        GuestPublic(guest_id=guest_id, name=guest.name, group=guest.group)
+        for guest_id, guest in zip(guest_ids, guests)
+    ]
+
+
+@router.post("/import/", response_model=GuestImport)
+async def import_guests(
+    request: Request,
+    session: Annotated[AsyncSession, AsyncSessionDep],
+    _: Annotated[str, AuthDep],
+):
+    """Import a CSV (with a name,group header) or NDJSON guest list in one transaction
+
+    The body is received in full first, so a slow upload doesn't hold the
+    single write connection and block RSVPs behind it.
+    """
+
+    format = import_format(request)
+    spool = await spool_body(request)
+    # newline="" lets the csv module handle line endings inside quoted fields
+    body = io.TextIOWrapper(spool, encoding="utf-8-sig", newline="")
+
+    result = GuestImport(imported=0)
+    chunk: list[GuestCreate] = []
+
+    async def flush():
+        guest_ids = await session.run_sync(insert_guests, chunk)
+        if guest_ids:
+            if result.first_guest_id is None:
+                result.first_guest_id = guest_ids[0]
+            result.last_guest_id = guest_ids[-1]
+            result.imported += len(guest_ids)
+        chunk.clear()
+
+    try:
+        for line_number, row in read_import_rows(format, body):
+            try:
+                chunk.append(GuestCreate.model_validate(row))
+            except ValidationError as e:
+                raise HTTPException(
+                    status_code=422,
+                    detail=f"Line {line_number}: {e.errors(include_url=False)}",
+                )
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                await flush()
+        await flush()
+        await session.commit()
+        guests_cache.bump()
+
+    except UnicodeDecodeError:
+        await session.rollback()
+        raise HTTPException(status_code=422, detail="Body is not valid UTF-8")
+    except Exception:
+        await session.rollback()
+        raise
+    finally:
+        body.close()
+
+    return result
+
+
+@router.post("/link/", response_model=GuestLinkResult)
+async def link_responses(
+    links: list[GuestLinkMany],
+    session: Annotated[AsyncSession, AsyncSessionDep],
+    _: Annotated[str, AuthDep],
+):
+    """Link many guests to responses in a single statement and transaction"""
 
-    return guests
+    if not links:
+        return GuestLinkResult(linked=0)
+
+    query = text(
+        """
+        UPDATE Guest
+        SET response_id = :response_id
+        WHERE guest_id = :guest_id;
+    """
+    )
+    params = [link.model_dump() for link in links]
+    async with tracking_groups(session, [link.guest_id for link in links]):
+        result = await session.execute(query, params)
+    await session.commit()
+    guests_cache.bump()
+    feed.publish("guests_linked", {"links": params})
+
+    return GuestLinkResult(linked=affected_rows(result))
+
+
+@router.post("/bulk/", response_model=BulkResult)
+async def bulk_update_guests(
+    bulk: GuestBulk,
+    session: Annotated[AsyncSession, AsyncSessionDep],
+    _: Annotated[str, AuthDep],
+):
+    """Soft-delete, restore or patch every guest matching the filters at once"""
+
+    require_filter(bulk.guest_ids, bulk.group)
+
+    query = update(Guest)
+    matching = select(Guest.guest_id)
+    if bulk.guest_ids is not None:
+        query = query.where(col(Guest.guest_id).in_(bulk.guest_ids))
+        matching = matching.where(col(Guest.guest_id).in_(bulk.guest_ids))
+    if bulk.group is not None:
+        query = query.where(col(Guest.group) == bulk.group)
+        matching = matching.where(col(Guest.group) == bulk.group)
+
+    if bulk.action == "patch":
+        values = patch_values(bulk.patch)
+        if "name" in values:
+            values["name_key"] = normalize_name(values["name"])
+    else:
+        values = {"active": bulk.action == "restore"}
+
+    guest_ids = [
+        guest_id
+        for guest_id in (await session.exec(matching)).all()
+        if guest_id is not None
+    ]
+    async with tracking_groups(session, guest_ids):
+        result = await session.execute(query.values(values))
+    await session.commit()
+    guests_cache.bump()
+
+    return BulkResult(affected=affected_rows(result))
 
 
 @router.post("/{guest_id}")
-def link_response(
+async def link_response(
     data: GuestLink,
     guest_id: int,
-    session: Annotated[Session, SessionDep],
+    session: Annotated[AsyncSession, AsyncSessionDep],
     _: Annotated[str, AuthDep],
 ):
-    guest = session.get(Guest, guest_id)
-    guest.response_id = data.response_id
-    session.add(guest)
-    session.commit()
-    session.refresh(guest)
+    guest = await session.get(Guest, guest_id)
+    async with tracking_groups(session, [guest_id]):
+        guest.response_id = data.response_id
+        session.add(guest)
+    await session.commit()
+    guests_cache.bump()
+    feed.publish(
+        "guests_linked",
+        {"links": [{"guest_id": guest_id, "response_id": data.response_id}]},
+    )
+    await session.refresh(guest)
 
     return guest
 
 
 @router.delete("/{guest_id}")
-def delete_guest(
-    guest_id: int, session: Annotated[Session, SessionDep], _: Annotated[str, AuthDep]
+async def delete_guest(
+    guest_id: int,
+    session: Annotated[AsyncSession, AsyncSessionDep],
+    _: Annotated[str, AuthDep],
 ):
-    response_db = session.get(Guest, guest_id)
+    response_db = await session.get(Guest, guest_id)
     if not response_db:
         raise HTTPException(status_code=404, detail="Response not found")
 
-    response_db.active = False
-    session.add(response_db)
-    session.commit()
+    async with tracking_groups(session, [guest_id]):
+        response_db.active = False
+        session.add(response_db)
+    await session.commit()
+    guests_cache.bump()
 
 
-@router.delete("/")
-def delete_all(
-    session: Annotated[Session, SessionDep], passkey: str, _: Annotated[str, AuthDep]
+@router.delete("/", response_model=BulkResult)
+async def delete_all(
+    session: Annotated[AsyncSession, AsyncSessionDep],
+    passkey: str,
+    _: Annotated[str, AuthDep],
 ):
-    guests = session.exec(select(Guest)).all()
-
-    print(os.getenv("DEL_PSK"))
     if passkey != os.getenv("DEL_PSK"):
         raise HTTPException(status_code=403, detail="Forbidden: Invalid passkey")
 
-    for guest in guests:
-        session.delete(guest)
+    result = await session.execute(delete(Guest))
+    await session.run_sync(rebuild_group_counts)
+    await session.commit()
+    guests_cache.bump()
 
-    session.commit()
+    return BulkResult(affected=affected_rows(result))
@@ -0,0 +1,101 @@
+import hmac
+import os
+from typing import Annotated
+
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from ..admission import write_gate
+from ..analytics import progress_analytics
+from ..dependencies import token_cache
+from ..feed import feed
+from ..idempotency import idempotency_store
+from ..metrics import CallbackGauge, registry
+from ..passwords import password_pool
+from ..snapshot import snapshot
+
+router = APIRouter()
+
+_ = registry.register(
+    CallbackGauge(
+        "token_cache",
+        "Verified token cache entries and lookups",
+        ("stat",),
+        lambda: [((stat,), value) for stat, value in token_cache.stats().items()],
+    )
+)
+_ = registry.register(
+    CallbackGauge(
+        "password_pool",
+        "argon2 operations running or queued, refused when saturated, and rehashes",
+        ("stat",),
+        lambda: [
+            (("pending",), password_pool.pending),
+            (("rejected",), password_pool.rejected),
+            (("rehashed",), password_pool.rehashed),
+        ],
+    )
+)
+_ = registry.register(
+    CallbackGauge(
+        "feed",
+        "Live feed subscribers, messages published and slow subscribers dropped",
+        ("stat",),
+        lambda: [((stat,), value) for stat, value in feed.stats().items()],
+    )
+)
+_ = registry.register(
+    CallbackGauge(
+        "progress_analytics",
+        "Headlines tracked by the progress sketches and events dropped over the cap",
+        ("stat",),
+        lambda: [
+            (("headlines",), len(progress_analytics)),
+            (("dropped",), progress_analytics.dropped),
+        ],
+    )
+)
+
+_ = registry.register(
+    CallbackGauge(
+        "read_snapshot",
+        "Read snapshot age in seconds, whether it is in use, copies taken and failed",
+        ("stat",),
+        lambda: [((stat,), value) for stat, value in snapshot.stats().items()],
+    )
+)
+
+_ = registry.register(
+    CallbackGauge(
+        "write_gate",
+        "Public write handlers running and RSVPs waiting for a slot",
+        ("stat",),
+        lambda: [((stat,), value) for stat, value in write_gate.stats().items()],
+    )
+)
+
+_ = registry.register(
+    CallbackGauge(
+        "idempotency_keys",
+        "Idempotency-Key responses cached in memory, lookups served and replays",
+        ("stat",),
+        lambda: [
+            ((stat,), value) for stat, value in idempotency_store.stats().items()
+        ],
+    )
+)
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def read_metrics(authorization: Annotated[str | None, Header()] = None):
+    """Prometheus text exposition; needs `Bearer $METRICS_TOKEN`, 404 when unset"""
+
+    expected = os.getenv("METRICS_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(authorization or "", f"Bearer {expected}"):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
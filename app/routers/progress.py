@@ -1,23 +1,69 @@
+import asyncio
 import os
-from typing import Annotated
+import time
+from typing import Annotated, Any, Literal
 
-from fastapi import APIRouter, HTTPException
-from sqlalchemy import func
+from fastapi import APIRouter, HTTPException, Request
+from sqlalchemy import Index, func, insert
+from sqlalchemy import select as select_columns
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
 from sqlmodel import Field  # pyright: ignore[reportUnknownVariableType]
-from sqlmodel import Session, SQLModel, select
+from sqlmodel import SQLModel, col, delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from ..dependencies import AuthDep, SessionDep
+from ..analytics import progress_analytics
+from ..bulk import BulkResult, affected_rows
+from ..bus import bus
+from ..cache import progress_cache
+from ..database import get_read_engine
+from ..dependencies import (
+    AsyncReadSessionDep,
+    AsyncSessionDep,
+    AsyncSnapshotSessionDep,
+    AuthDep,
+    IdempotencyDep,
+    ProgressAdmissionDep,
+)
+from ..feed import feed
+from ..idempotency import Idempotency
+from ..pagination import PageDep, PageParams, paginate
+from ..progress_log import ProgressLog
 
 router = APIRouter()
 
 
 class ProgressBase(SQLModel):
     timestamp: int = Field()
-    headline: str = Field(index=True)
+    headline: str = Field()
 
 
 class Progress(ProgressBase, table=True):
+    # Covers the per-headline group-bys without touching the table rows
+    __table_args__ = (Index("ix_progress_headline_timestamp", "headline", "timestamp"),)
+
     progress_id: int | None = Field(primary_key=True, default=None)
+    # Server arrival time in ms since the epoch, unlike the client's timestamp
+    received: int | None = Field(default=None)
+
+
+class ProgressAggregate(SQLModel, table=True):
+    headline: str = Field(primary_key=True)
+    amount: int = Field(default=0)
+    total: int = Field(default=0)
+    first_timestamp: int = Field()
+    last_timestamp: int = Field()
+
+
+# (headline, amount, total, first, last) recomputed from the raw table; more
+# columns than sqlmodel's select() is typed for
+AGGREGATE_TOTALS = select_columns(
+    col(Progress.headline),
+    func.count(),
+    func.sum(Progress.timestamp),
+    func.min(Progress.timestamp),
+    func.max(Progress.timestamp),
+).group_by(col(Progress.headline))
 
 
 class ProgressAvg(SQLModel):
@@ -36,74 +82,370 @@ class ProgressStat(SQLModel):
     average: float = Field()
 
 
+class ProgressQuantiles(SQLModel):
+    headline: str = Field()
+    amount: int = Field()
+    p50: float | None = Field()
+    p90: float | None = Field()
+    p99: float | None = Field()
+
+
+class ProgressBucket(SQLModel):
+    headline: str = Field()
+    start: int = Field()
+    amount: int = Field()
+
+
+class ProgressAnalyticsRebuild(SQLModel):
+    headlines: int = Field()
+    dropped: int = Field()
+
+
+def update_aggregates(session: Session, events: list[dict[str, Any]]) -> None:
+    rows: dict[str, dict[str, Any]] = {}
+    for event in events:
+        headline: str = event["headline"]
+        timestamp: int = event["timestamp"]
+        row = rows.get(headline)
+        if row is None:
+            rows[headline] = {
+                "headline": headline,
+                "amount": 1,
+                "total": timestamp,
+                "first_timestamp": timestamp,
+                "last_timestamp": timestamp,
+            }
+        else:
+            row["amount"] += 1
+            row["total"] += timestamp
+            row["first_timestamp"] = min(row["first_timestamp"], timestamp)
+            row["last_timestamp"] = max(row["last_timestamp"], timestamp)
+
+    if not rows:
+        return
+
+    aggregate = ProgressAggregate.__table__  # pyright: ignore[reportAttributeAccessIssue]
+    stmt = sqlite_insert(aggregate)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[aggregate.c.headline],
+        set_={
+            "amount": aggregate.c.amount + stmt.excluded.amount,
+            "total": aggregate.c.total + stmt.excluded.total,
+            "first_timestamp": func.min(
+                aggregate.c.first_timestamp, stmt.excluded.first_timestamp
+            ),
+            "last_timestamp": func.max(
+                aggregate.c.last_timestamp, stmt.excluded.last_timestamp
+            ),
+        },
+    )
+    _ = session.execute(stmt, list(rows.values()))
+
+
+def insert_progresses(session: Session, events: list[dict[str, Any]]) -> None:
+    # Segments written before arrival times were recorded have no "received"
+    rows = [{"received": None} | event for event in events]
+    _ = session.execute(insert(Progress), rows)
+    update_aggregates(session, events)
+
+
+def rebuild_aggregates(session: Session) -> None:
+    _ = session.execute(delete(ProgressAggregate))
+    _ = session.execute(
+        insert(ProgressAggregate).from_select(
+            ["headline", "amount", "total", "first_timestamp", "last_timestamp"],
+            AGGREGATE_TOTALS,
+        )
+    )
+
+
+def verify_aggregates(session: Session) -> list[str]:
+    """Compare the aggregate store against a full recompute of the raw table"""
+
+    stored = {
+        row.headline: (row.amount, row.total, row.first_timestamp, row.last_timestamp)
+        for row in session.scalars(select(ProgressAggregate)).all()
+    }
+    actual = {
+        headline: (amount, total, first, last)
+        for headline, amount, total, first, last in session.execute(
+            AGGREGATE_TOTALS
+        ).all()
+    }
+
+    mismatches: list[str] = []
+    for headline in sorted(stored.keys() | actual.keys()):
+        if stored.get(headline) != actual.get(headline):
+            mismatches.append(
+                f"{headline}: stored {stored.get(headline)}, actual {actual.get(headline)}"
+            )
+    return mismatches
+
+
+def ensure_aggregates(session: Session) -> None:
+    has_aggregates = session.scalars(
+        select(ProgressAggregate.headline).limit(1)
+    ).first()
+    has_progress = session.scalars(select(Progress.progress_id).limit(1)).first()
+    if has_aggregates is None and has_progress is not None:
+        rebuild_aggregates(session)
+        session.commit()
+
+
+def rebuild_analytics(session: Session) -> None:
+    """Rebuild the in-memory sketches by streaming the raw Progress table"""
+
+    progress_analytics.begin_rebuild()
+    rows = session.execute(
+        select(
+            Progress.headline, Progress.timestamp, Progress.received
+        ).execution_options(yield_per=5000)
+    ).tuples()
+    progress_analytics.finish_rebuild(rows)
+
+
+def rebuild_analytics_from_peer(seq: int, origin: dict[str, int]) -> None:
+    """Rebuild this worker's sketches when another worker was asked to"""
+
+    if origin["pid"] == os.getpid():
+        return
+
+    def rebuild():
+        with Session(get_read_engine()) as session:
+            rebuild_analytics(session)
+
+    _ = asyncio.get_running_loop().run_in_executor(None, rebuild)
+
+
+def reset_from_peer(seq: int, origin: dict[str, int]) -> None:
+    """Forget this worker's sketches and, if another worker purged, its log
+
+    Events this worker logs or compacts between the purge and hearing of it
+    (one bus poll) are dropped or kept with the purged ones; that window is
+    accepted.
+    """
+
+    progress_analytics.clear()
+    if origin["pid"] != os.getpid():
+        _ = asyncio.get_running_loop().run_in_executor(None, progress_log.discard)
+
+
+bus.subscribe("progress_events", lambda _, events: progress_analytics.observe(events))
+bus.subscribe("progress_reset", reset_from_peer)
+bus.subscribe("progress_analytics_rebuild", rebuild_analytics_from_peer)
+
+
+def progress_applied(events: list[dict[str, Any]]) -> None:
+    progress_cache.bump()
+    bus.publish("progress_events", events)
+
+    counts: dict[str, int] = {}
+    for event in events:
+        counts[event["headline"]] = counts.get(event["headline"], 0) + 1
+    feed.publish("progress", {"counts": counts})
+
+
+progress_log = ProgressLog(
+    os.getenv("PROGRESS_LOG_DIR", "db_data/progress_log"),
+    insert_progresses,
+    enabled=os.getenv("PROGRESS_LOG", "false").lower() in ("1", "true"),
+    interval=float(os.getenv("PROGRESS_LOG_INTERVAL", "1.0")),
+    fsync=os.getenv("PROGRESS_LOG_FSYNC", "false").lower() in ("1", "true"),
+    on_applied=progress_applied,
+)
+
+
 @router.get("/", response_model=list[ProgressBase])
-def read_progress(session: Annotated[Session, SessionDep]):
-    progresses = session.exec(select(Progress)).all()
-    return progresses
+async def read_progress(
+    request: Request,
+    session: Annotated[AsyncSession, AsyncReadSessionDep],
+    page: Annotated[PageParams, PageDep],
+):
+    query = select(Progress)
+    if page.after is not None:
+        query = query.where(col(Progress.progress_id) > page.after)
+    if page.paginated:
+        query = query.order_by(col(Progress.progress_id))
+    if page.limit is not None:
+        query = query.limit(page.limit + 1)
+
+    async def build():
+        rows = (await session.exec(query)).all()
+        return paginate(rows, page, lambda row: row.progress_id)
+
+    return await progress_cache.respond(
+        request, build, list[ProgressBase], fields=page.fields
+    )
 
 
 @router.get("/avg/", response_model=list[ProgressAvg])
-def read_progress_averages(session: Annotated[Session, SessionDep]):
-    averages = func.avg(Progress.timestamp).label("average")
-    progresses = session.exec(
-        select(Progress.headline, averages)
-        .group_by(Progress.headline)
-        .order_by(averages.desc())
-    ).all()
-    return progresses
+async def read_progress_averages(
+    request: Request, session: Annotated[AsyncSession, AsyncSnapshotSessionDep]
+):
+    averages = (
+        col(ProgressAggregate.total) * 1.0 / col(ProgressAggregate.amount)
+    ).label("average")
+
+    async def build():
+        return (
+            await session.exec(
+                select(ProgressAggregate.headline, averages).order_by(averages.desc())
+            )
+        ).all()
+
+    return await progress_cache.respond(
+        request, build, list[ProgressAvg], snapshot=session.info["snapshot"]
+    )
 
 
 @router.get("/count/", response_model=list[ProgressCount])
-def read_progress_counts(
-    session: Annotated[Session, SessionDep], _: Annotated[str, AuthDep]
+async def read_progress_counts(
+    request: Request,
+    session: Annotated[AsyncSession, AsyncSnapshotSessionDep],
+    _: Annotated[str, AuthDep],
 ):
-    counts = func.count(Progress.headline).label(  # pyright: ignore[reportArgumentType]
-        "amount"
+    async def build():
+        return (
+            await session.exec(
+                select(ProgressAggregate.headline, ProgressAggregate.amount).order_by(
+                    col(ProgressAggregate.amount).desc()
+                )
+            )
+        ).all()
+
+    return await progress_cache.respond(
+        request, build, list[ProgressCount], snapshot=session.info["snapshot"]
     )
-    progresses = session.exec(
-        select(Progress.headline, counts)
-        .group_by(Progress.headline)
-        .order_by(counts.desc())
-    ).all()
-    return progresses
 
 
 @router.get("/stats/", response_model=list[ProgressStat])
-def read_progress_stats(session: Annotated[Session, SessionDep]):
-    averages = func.avg(Progress.timestamp).label("average")
-    counts = func.count(Progress.headline).label(  # pyright: ignore[reportArgumentType]
-        "amount"
+async def read_progress_stats(
+    request: Request, session: Annotated[AsyncSession, AsyncSnapshotSessionDep]
+):
+    averages = (
+        col(ProgressAggregate.total) * 1.0 / col(ProgressAggregate.amount)
+    ).label("average")
+
+    async def build():
+        return (
+            await session.exec(
+                select(
+                    ProgressAggregate.headline, ProgressAggregate.amount, averages
+                ).order_by(col(ProgressAggregate.amount).desc())
+            )
+        ).all()
+
+    return await progress_cache.respond(
+        request, build, list[ProgressStat], snapshot=session.info["snapshot"]
+    )
+
+
+@router.get("/quantiles/", response_model=list[ProgressQuantiles])
+async def read_progress_quantiles(_: Annotated[str, AuthDep]):
+    """Estimated p50/p90/p99 of the client-reported elapsed `timestamp` per headline
+
+    Each estimate is within 1% of a true value. Arrival times are only counted
+    by /histogram/.
+    """
+
+    return [
+        ProgressQuantiles(
+            headline=row["headline"],
+            amount=row["amount"],
+            p50=row["quantiles"][0.5],
+            p90=row["quantiles"][0.9],
+            p99=row["quantiles"][0.99],
+        )
+        for row in progress_analytics.quantiles((0.5, 0.9, 0.99))
+    ]
+
+
+@router.get("/histogram/", response_model=list[ProgressBucket])
+async def read_progress_histogram(
+    _: Annotated[str, AuthDep],
+    resolution: Literal["minute", "hour"] = "minute",
+    headline: str | None = None,
+):
+    """Event counts per minute or hour of server arrival, keyed by bucket start
+
+    Bucket starts are ms since the epoch. Events stored before arrival times
+    were recorded are not counted.
+    """
+
+    return progress_analytics.histogram(resolution, headline)
+
+
+@router.post("/analytics/rebuild", response_model=ProgressAnalyticsRebuild)
+async def rebuild_progress_analytics(
+    session: Annotated[AsyncSession, AsyncReadSessionDep],
+    _: Annotated[str, AuthDep],
+):
+    await session.run_sync(rebuild_analytics)
+    bus.publish("progress_analytics_rebuild", {"pid": os.getpid()})
+
+    return ProgressAnalyticsRebuild(
+        headlines=len(progress_analytics),
+        dropped=progress_analytics.dropped,
     )
-    progresses = session.exec(
-        select(Progress.headline, counts, averages)
-        .group_by(Progress.headline)
-        .order_by(counts.desc())
-    ).all()
-    return progresses
 
 
-@router.post("/")
-def create_progress(
+@router.post("/", dependencies=[ProgressAdmissionDep])
+async def create_progress(
     progress: ProgressBase,
-    session: Annotated[Session, SessionDep],
+    idempotency: Annotated[Idempotency, IdempotencyDep],
+    session: Annotated[AsyncSession, AsyncSessionDep],
 ):
-    db_progress = Progress.model_validate(progress)
+    if idempotency.replay is not None:
+        return idempotency.replay
+
+    db_progress = Progress.model_validate(
+        progress, update={"received": time.time_ns() // 1_000_000}
+    )
+    event = db_progress.model_dump(exclude={"progress_id"})
+    if progress_log.enabled:
+        # The key's row is written first, so a concurrent retry conflicts on
+        # it, but only committed once the event is in the log: a failed
+        # append leaves no key behind that would replay an event never logged.
+        if idempotency.key is not None:
+            replayed = await idempotency.save(session, db_progress)
+            if replayed is not None:
+                await session.rollback()
+                return replayed
+        try:
+            await asyncio.to_thread(progress_log.append, event)
+        except Exception:
+            await session.rollback()
+            raise
+        await session.commit()
+        return db_progress
+
     session.add(db_progress)
-    session.commit()
-    session.refresh(db_progress)
+    await session.run_sync(update_aggregates, [event])
+    await session.flush()
+    replayed = await idempotency.save(session, db_progress)
+    if replayed is not None:
+        await session.rollback()
+        return replayed
+    await session.commit()
+    progress_applied([event])
+    await session.refresh(db_progress)
 
     return db_progress
 
 
-@router.delete("/")
-def delete_all(
-    session: Annotated[Session, SessionDep], passkey: str, _: Annotated[str, AuthDep]
-):
+@router.delete("/", response_model=BulkResult)
+async def delete_all(passkey: str, _: Annotated[str, AuthDep]):
     if passkey != os.getenv("DEL_PSK"):
         raise HTTPException(status_code=403, detail="Forbidden: Invalid passkey")
 
-    progresses = session.exec(select(Progress)).all()
-    for progress in progresses:
-        session.delete(progress)
+    def clear(session: Session) -> int:
+        result = session.execute(delete(Progress))
+        _ = session.execute(delete(ProgressAggregate))
+        return affected_rows(result)
+
+    # Logged events not yet compacted are dropped in the same transaction
+    affected = await asyncio.to_thread(progress_log.purge, clear)
+    progress_cache.bump()
+    bus.publish("progress_reset", {"pid": os.getpid()})
 
-    session.commit()
+    return BulkResult(affected=affected)
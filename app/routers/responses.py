@@ -1,8 +1,9 @@
 import datetime
 import os
-from typing import Annotated, Optional
+from typing import Annotated, Literal, Optional
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from sqlalchemy import update
 from sqlmodel import Column  # pyright: ignore[reportUnknownVariableType]
 from sqlmodel import (
     DateTime,
@@ -10,12 +11,29 @@ from sqlmodel import (
     Relationship,
     Session,
     SQLModel,
+    col,
     column,
+    delete,
     select,
     text,
 )
-
-from ..dependencies import AuthDep, SessionDep
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ..bulk import BulkResult, affected_rows, patch_values, require_filter
+from ..cache import guests_cache, responses_cache
+from ..coalesce import Coalesced
+from ..dependencies import (
+    AsyncReadSessionDep,
+    AsyncSessionDep,
+    AuthDep,
+    CoalesceDep,
+    IdempotencyDep,
+    ResponseAdmissionDep,
+)
+from ..feed import feed
+from ..idempotency import Idempotency
+from ..pagination import PageDep, PageParams, paginate
+from ..rollup import linked_guests, rebuild_group_counts, tracking_groups
 
 router = APIRouter()
 
@@ -31,7 +49,7 @@ class Response(ResponseBase, table=True):
     time: datetime.datetime | None = Field(
         default=None, sa_column=Column(DateTime(timezone=False), nullable=False)
     )
-    active: bool = Field(default=True)
+    active: bool = Field(default=True, index=True)
 
 
 class ResponsePublic(ResponseBase):
@@ -43,97 +61,221 @@ class ResponseCreate(ResponseBase):
     pass
 
 
+class ResponsePatch(SQLModel):
+    name: str | None = Field(default=None)
+    diet: str | None = Field(default=None)
+    rsvp: bool | None = Field(default=None)
+
+
+class ResponseBulk(SQLModel):
+    action: Literal["delete", "restore", "patch"] = Field()
+    response_ids: list[int] | None = Field(default=None)
+    rsvp: bool | None = Field(default=None)
+    patch: ResponsePatch | None = Field(default=None)
+
+
+def normalize_name(name: str) -> str:
+    """Key used to match RSVP names to guests regardless of case and spacing"""
+
+    return " ".join(name.split()).casefold()
+
+
 @router.get("/", response_model=list[ResponsePublic])
-def read_responses(session: Annotated[Session, SessionDep], _: Annotated[str, AuthDep]):
-    responses = session.exec(select(Response).where(Response.active == True)).all()
-    return responses
+async def read_responses(
+    request: Request,
+    session: Annotated[AsyncSession, AsyncReadSessionDep],
+    page: Annotated[PageParams, PageDep],
+    _: Annotated[str, AuthDep],
+):
+    query = select(Response).where(Response.active == True)
+    if page.after is not None:
+        query = query.where(col(Response.response_id) > page.after)
+    if page.paginated:
+        query = query.order_by(col(Response.response_id))
+    if page.limit is not None:
+        query = query.limit(page.limit + 1)
+
+    async def build():
+        rows = (await session.exec(query)).all()
+        return paginate(rows, page, lambda row: row.response_id)
+
+    return await responses_cache.respond(
+        request, build, list[ResponsePublic], fields=page.fields
+    )
 
 
 @router.get("/{response_id}", response_model=ResponsePublic)
-def read_response(
+async def read_response(
     response_id: int,
-    session: Annotated[Session, SessionDep],
+    session: Annotated[AsyncSession, AsyncReadSessionDep],
+    coalesced: Annotated[Coalesced, CoalesceDep],
     _: Annotated[str, AuthDep],
 ):
-    response = session.get(Response, response_id)
-    if not response:
-        raise HTTPException(status_code=404, detail="Response not found")
+    async def build():
+        response = await session.get(Response, response_id)
+        if not response:
+            raise HTTPException(status_code=404, detail="Response not found")
+        return response
 
-    return response
+    return await coalesced.do(build)
 
 
-@router.post("/", response_model=ResponsePublic)
-def create_response(
+@router.post(
+    "/", response_model=ResponsePublic, dependencies=[ResponseAdmissionDep]
+)
+async def create_response(
     response: ResponseCreate,
-    session: Annotated[Session, SessionDep],
+    idempotency: Annotated[Idempotency, IdempotencyDep],
+    session: Annotated[AsyncSession, AsyncSessionDep],
 ):
+    if idempotency.replay is not None:
+        return idempotency.replay
+
     db_response = Response.model_validate(response)
     db_response.time = datetime.datetime.now()
     session.add(db_response)
-    session.commit()
-    session.refresh(db_response)
+    await session.flush()
 
     query = text(
         """
         UPDATE Guest
         SET response_id = :response_id
-        WHERE name = :name;
+        WHERE name_key = :name_key
+        RETURNING guest_id;
     """
     )
 
-    session.exec(
-        query.bindparams(response_id=db_response.response_id, name=db_response.name)
-    )
-    session.commit()
+    name_key = normalize_name(db_response.name)
+    async with tracking_groups(session, name_key=name_key):
+        guest_ids = (
+            await session.execute(
+                query.bindparams(response_id=db_response.response_id, name_key=name_key)
+            )
+        ).all()
+    result = ResponsePublic.model_validate(db_response)
+    replayed = await idempotency.save(session, result)
+    if replayed is not None:
+        await session.rollback()
+        return replayed
+
+    await session.commit()
+    responses_cache.bump()
+    guests_cache.bump()
+
+    feed.publish("response", result.model_dump(mode="json"))
+    if guest_ids:
+        feed.publish(
+            "guests_linked",
+            {
+                "links": [
+                    {"guest_id": guest_id, "response_id": db_response.response_id}
+                    for (guest_id,) in guest_ids
+                ]
+            },
+        )
 
     return db_response
 
 
+@router.post("/bulk/", response_model=BulkResult)
+async def bulk_update_responses(
+    bulk: ResponseBulk,
+    session: Annotated[AsyncSession, AsyncSessionDep],
+    _: Annotated[str, AuthDep],
+):
+    """Soft-delete, restore or patch every response matching the filters at once"""
+
+    require_filter(bulk.response_ids, bulk.rsvp)
+
+    query = update(Response)
+    matching = select(Response.response_id)
+    if bulk.response_ids is not None:
+        query = query.where(col(Response.response_id).in_(bulk.response_ids))
+        matching = matching.where(col(Response.response_id).in_(bulk.response_ids))
+    if bulk.rsvp is not None:
+        query = query.where(col(Response.rsvp) == bulk.rsvp)
+        matching = matching.where(col(Response.rsvp) == bulk.rsvp)
+
+    if bulk.action == "patch":
+        values = patch_values(bulk.patch, nullable={"diet"})
+    else:
+        values = {"active": bulk.action == "restore"}
+
+    response_ids = [
+        response_id
+        for response_id in (await session.exec(matching)).all()
+        if response_id is not None
+    ]
+    guest_ids = await session.run_sync(linked_guests, response_ids)
+    async with tracking_groups(session, guest_ids):
+        result = await session.execute(query.values(values))
+    await session.commit()
+    responses_cache.bump()
+    guests_cache.bump()
+
+    return BulkResult(affected=affected_rows(result))
+
+
 @router.patch("/{response_id}", response_model=ResponsePublic)
-def update_response(
+async def update_response(
     response_id: int,
     response: Response,
-    session: Annotated[Session, SessionDep],
+    session: Annotated[AsyncSession, AsyncSessionDep],
     _: Annotated[str, AuthDep],
 ):
-    response_db = session.get(Response, response_id)
+    response_db = await session.get(Response, response_id)
     if not response_db:
         raise HTTPException(status_code=404, detail="Response not found")
 
     response_data = response.model_dump(exclude_unset=True)
-    _ = response_db.sqlmodel_update(response_data)
-
-    session.add(response_db)
-    session.commit()
-    session.refresh(response_db)
+    guest_ids = await session.run_sync(linked_guests, [response_id])
+    async with tracking_groups(session, guest_ids):
+        _ = response_db.sqlmodel_update(response_data)
+        session.add(response_db)
+    await session.commit()
+    responses_cache.bump()
+    guests_cache.bump()
+    await session.refresh(response_db)
 
     return response_db
 
 
 @router.delete("/{response_id}")
-def delete_response(
+async def delete_response(
     response_id: int,
-    session: Annotated[Session, SessionDep],
+    session: Annotated[AsyncSession, AsyncSessionDep],
     _: Annotated[str, AuthDep],
 ):
-    response_db = session.get(Response, response_id)
+    response_db = await session.get(Response, response_id)
     if not response_db:
         raise HTTPException(status_code=404, detail="Response not found")
 
-    response_db.active = False
-    session.add(response_db)
-    session.commit()
+    guest_ids = await session.run_sync(linked_guests, [response_id])
+    async with tracking_groups(session, guest_ids):
+        response_db.active = False
+        session.add(response_db)
+    await session.commit()
+    responses_cache.bump()
+    guests_cache.bump()
 
 
-@router.delete("/")
-def delete_all(
-    session: Annotated[Session, SessionDep], passkey: str, _: Annotated[str, AuthDep]
+@router.delete("/", response_model=BulkResult)
+async def delete_all(
+    session: Annotated[AsyncSession, AsyncSessionDep],
+    passkey: str,
+    _: Annotated[str, AuthDep],
 ):
     if passkey != os.getenv("DEL_PSK"):
         raise HTTPException(status_code=403, detail="Forbidden: Invalid passkey")
 
-    responses = session.exec(select(Response)).all()
-    for response in responses:
-        session.delete(response)
+    # Response ids get reused once the table is empty, so unlink guests first.
+    await session.execute(
+        text("UPDATE Guest SET response_id = NULL WHERE response_id IS NOT NULL;")
+    )
+    result = await session.execute(delete(Response))
+    await session.run_sync(rebuild_group_counts)
+    await session.commit()
+    responses_cache.bump()
+    guests_cache.bump()
 
-    session.commit()
+    return BulkResult(affected=affected_rows(result))
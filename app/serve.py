@@ -0,0 +1,71 @@
+"""serve.py - run the API in several worker processes sharing one database
+
+    python -m app.serve --workers 4
+
+The parent migrates the database and replays the progress log once, creates
+the shared state the workers use for cache versions and the event bus, and
+then hands over to uvicorn's process supervisor. `kill -HUP <parent pid>`
+restarts the workers one at a time to pick up new code without dropping the
+listening socket.
+"""
+
+import os
+from pathlib import Path
+
+import typer
+import uvicorn
+
+from .database import get_engine
+from .shared import SharedState
+
+cli = typer.Typer()
+
+
+@cli.command()
+def serve(
+    workers: int = typer.Option(
+        int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1))),
+        help="Worker processes, one per CPU by default",
+    ),
+    host: str = typer.Option("0.0.0.0"),
+    port: int = typer.Option(8000),
+    state_dir: Path = typer.Option(
+        Path(os.getenv("SHARED_STATE_DIR", "db_data/run")),
+        help="Directory for state shared between workers",
+    ),
+    graceful_timeout: int = typer.Option(
+        30, help="Seconds a stopping worker gets to finish in-flight requests"
+    ),
+):
+    """Serve the API with uvloop and httptools in `workers` processes"""
+
+    # Before app.main is imported, since importing it opens the shared state
+    _ = SharedState.create(state_dir)
+    os.environ["SHARED_STATE_DIR"] = str(state_dir)
+
+    from .main import prepare
+
+    prepare()
+    # Workers open their own connections; don't leave the parent's pooled
+    get_engine().dispose()
+
+    os.environ["APP_PREPARED"] = "1"
+    # argon2 threads in every worker would otherwise oversubscribe the CPUs
+    os.environ.setdefault(
+        "PASSWORD_WORKERS", str(max(1, (os.cpu_count() or 1) // workers))
+    )
+
+    uvicorn.run(
+        "app.main:app",
+        host=host,
+        port=port,
+        workers=workers,
+        loop="uvloop",
+        http="httptools",
+        proxy_headers=True,
+        timeout_graceful_shutdown=graceful_timeout,
+    )
+
+
+if __name__ == "__main__":
+    cli()
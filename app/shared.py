@@ -0,0 +1,111 @@
+"""shared.py - counters shared by every worker process through a mapped file
+
+`python -m app.serve` creates a fresh state file before starting workers and
+passes its location in SHARED_STATE_DIR. A process started with the variable
+set by other means creates the file if it doesn't exist yet. Without it (a
+single uvicorn process) the counters live in anonymous memory private to the
+process.
+"""
+
+import fcntl
+import mmap
+import os
+import struct
+import threading
+from pathlib import Path
+
+SLOTS = 32
+SLOT = struct.Struct("<Q")
+HEADER_SIZE = 8
+STATE_FILE = "state"
+
+# Slot numbers are fixed so every process agrees on them
+GUESTS_VERSION = 0
+RESPONSES_VERSION = 1
+PROGRESS_VERSION = 2
+BUS_GENERATION = 8
+
+
+class SharedState:
+    def __init__(self, directory: Path | None):
+        self.directory = directory
+        size = HEADER_SIZE + SLOTS * SLOT.size
+        self._lock = threading.Lock()
+        self._fd: int | None = None
+        if directory is None:
+            self._map = mmap.mmap(-1, size)
+            self._map[:HEADER_SIZE] = os.urandom(HEADER_SIZE)
+        else:
+            directory.mkdir(parents=True, exist_ok=True)
+            self._fd = os.open(directory / STATE_FILE, os.O_RDWR | os.O_CREAT, 0o644)
+            # The first of several processes starting at once initializes it
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self._fd).st_size < size:
+                    os.ftruncate(self._fd, size)
+                    _ = os.pwrite(self._fd, os.urandom(HEADER_SIZE), 0)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            self._map = mmap.mmap(self._fd, size)
+
+        # Versions restart from zero with each run, so ETags carry this id to
+        # never match a body served by an earlier run.
+        self.boot_id = self._map[:4].hex()
+
+    @classmethod
+    def create(cls, directory: Path) -> "SharedState":
+        """Start a fresh state file for a new run of worker processes"""
+
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / STATE_FILE
+        tmp = path.with_suffix(".tmp")
+        _ = tmp.write_bytes(os.urandom(HEADER_SIZE) + bytes(SLOTS * SLOT.size))
+        os.replace(tmp, path)
+        return cls(directory)
+
+    @classmethod
+    def from_env(cls) -> "SharedState":
+        directory = os.getenv("SHARED_STATE_DIR")
+        return cls(Path(directory) if directory else None)
+
+    @property
+    def shared(self) -> bool:
+        return self.directory is not None
+
+    def get(self, slot: int) -> int:
+        return SLOT.unpack_from(self._map, HEADER_SIZE + slot * SLOT.size)[0]
+
+    def bump(self, slot: int) -> int:
+        with self.locked():
+            return self.increment(slot)
+
+    def increment(self, slot: int) -> int:
+        """Add one to a slot; the caller must hold locked()"""
+
+        value = self.get(slot) + 1
+        SLOT.pack_into(self._map, HEADER_SIZE + slot * SLOT.size, value)
+        return value
+
+    def locked(self) -> "StateLock":
+        return StateLock(self._lock, self._fd)
+
+
+class StateLock:
+    """Thread lock plus, when shared, an exclusive flock on the state file"""
+
+    def __init__(self, lock: threading.Lock, fd: int | None):
+        self.lock = lock
+        self.fd = fd
+
+    def __enter__(self) -> None:
+        _ = self.lock.acquire()
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def __exit__(self, *_: object) -> None:
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        self.lock.release()
+
+
+shared_state = SharedState.from_env()
@@ -0,0 +1,185 @@
+"""snapshot.py - periodic copy of the database for long analytics reads
+
+A background task copies the live database to a snapshot file with SQLite's
+online backup API and points a separate read engine at it. Endpoints that can
+tolerate slightly old data read through get_async_snapshot_session and stay
+off the primary file; when the snapshot is older than the staleness bound
+(say the copy keeps failing) they quietly fall back to the primary.
+
+Worker processes share the snapshot file: whichever takes the lock makes the
+copy, and every worker swaps its engine when it sees a new file.
+"""
+
+import asyncio
+import fcntl
+import logging
+import os
+import sqlite3
+import time
+from collections.abc import AsyncGenerator
+from pathlib import Path
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from .database import create_async_sqlite_engine, get_async_read_engine, sqlite_file
+from .metrics import instrument_engine
+
+logger = logging.getLogger(__name__)
+
+
+class ReadSnapshot:
+    def __init__(
+        self,
+        source: str,
+        path: str,
+        interval: float = 60.0,
+        max_staleness: float = 300.0,
+        pool_size: int = 8,
+    ):
+        self.source = source
+        self.path = Path(path)
+        self.interval = interval
+        self.max_staleness = max_staleness
+        self.pool_size = pool_size
+        self.taken = 0
+        self.failed = 0
+
+        self._engine: AsyncEngine | None = None
+        self._mtime_ns = 0
+        self._task: asyncio.Task[None] | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    @property
+    def age(self) -> float | None:
+        """Seconds since the snapshot in use was taken, None without one"""
+
+        if self._engine is None:
+            return None
+        return time.time() - self._mtime_ns / 1e9
+
+    @property
+    def fresh(self) -> bool:
+        age = self.age
+        return age is not None and age <= self.max_staleness
+
+    def current(self) -> tuple[AsyncEngine, str | None]:
+        """The engine to read from and the snapshot's version, None for primary
+
+        The version is the snapshot file's mtime, the same in every worker.
+        """
+
+        if self._engine is not None and self.fresh:
+            return self._engine, str(self._mtime_ns)
+        return get_async_read_engine(), None
+
+    def take(self) -> bool:
+        """Copy the database unless another process did so within the interval"""
+
+        lock_path = self.path.with_name(self.path.name + ".lock")
+        with open(lock_path, "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+
+            try:
+                if time.time() - self.path.stat().st_mtime < self.interval:
+                    return False
+            except FileNotFoundError:
+                pass
+
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            source = sqlite3.connect(self.source)
+            target = sqlite3.connect(tmp)
+            try:
+                # One step keeps a single read transaction open for the whole
+                # copy, which in WAL mode is consistent and never blocks writers.
+                source.backup(target)
+                # The copy inherits WAL mode; readers of a file that is never
+                # written are simpler without the -wal and -shm files.
+                _ = target.execute("PRAGMA journal_mode=DELETE")
+            finally:
+                target.close()
+                source.close()
+            os.replace(tmp, self.path)
+            return True
+
+    async def refresh(self) -> None:
+        try:
+            if await asyncio.to_thread(self.take):
+                self.taken += 1
+        except (OSError, sqlite3.Error):
+            self.failed += 1
+            logger.exception("Taking a database snapshot failed")
+
+        try:
+            mtime_ns = self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime_ns != self._mtime_ns:
+            await self._swap(mtime_ns)
+
+    async def _swap(self, mtime_ns: int) -> None:
+        old = self._engine
+        self._engine = create_async_sqlite_engine(
+            url=f"sqlite+aiosqlite:///{self.path}",
+            readonly=True,
+            pool_size=self.pool_size,
+        )
+        instrument_engine(self._engine.sync_engine, "snapshot")
+        self._mtime_ns = mtime_ns
+        if old is not None:
+            # Connections still checked out keep the replaced file open until
+            # their request returns them; idle ones are closed now.
+            await old.dispose()
+
+    async def run(self) -> None:
+        while True:
+            await self.refresh()
+            await asyncio.sleep(min(self.interval, 1.0))
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            _ = self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._engine is not None:
+            await self._engine.dispose()
+            self._engine = None
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "age_seconds": self.age or 0.0,
+            "fresh": int(self.fresh),
+            "taken": self.taken,
+            "failed": self.failed,
+        }
+
+
+snapshot = ReadSnapshot(
+    source=sqlite_file,
+    path=os.getenv("SNAPSHOT_FILE", f"{sqlite_file}.snapshot"),
+    interval=float(os.getenv("SNAPSHOT_INTERVAL", "0")),
+    max_staleness=float(os.getenv("SNAPSHOT_MAX_STALENESS", "300")),
+    pool_size=int(os.getenv("SQLITE_READ_POOL_SIZE", "8")),
+)
+
+
+async def get_async_snapshot_session() -> AsyncGenerator[AsyncSession, None]:
+    """Read session on the snapshot; session.info["snapshot"] names it or is None"""
+
+    engine, version = snapshot.current()
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        session.info["snapshot"] = version
+        yield session
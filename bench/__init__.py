@@ -0,0 +1 @@
+"""bench - seeded load tests for the API, run with `python -m bench`"""
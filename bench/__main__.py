@@ -0,0 +1,139 @@
+"""__main__.py - seed a throwaway database, benchmark every router, compare runs"""
+
+import asyncio
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import typer
+
+cli = typer.Typer()
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@cli.command()
+def run(
+    users: int = typer.Option(20, help="Concurrent virtual users per endpoint"),
+    requests: int = typer.Option(1000, help="Requests per endpoint"),
+    guests: int = typer.Option(500, help="Guests to seed"),
+    progress: int = typer.Option(100_000, help="Progress events to seed"),
+    cold: bool = typer.Option(False, help="Bypass the response cache on list reads"),
+    only: list[str] = typer.Option([], help="Run only endpoints with this prefix"),
+    seed: int = typer.Option(1234, help="Random seed for data and requests"),
+    save: Path | None = typer.Option(None, help="Write results to this JSON file"),
+):
+    """Benchmark every endpoint against a freshly seeded temporary database"""
+
+    with tempfile.TemporaryDirectory(prefix="wedding-bench-") as directory:
+        # The engines are created at import, so point them at the temporary
+        # database before anything from app is imported.
+        os.environ["SQLITE_FILE"] = f"{directory}/bench.db"
+        os.environ["PROGRESS_LOG_DIR"] = f"{directory}/progress_log"
+        os.environ.setdefault("SECRET", "bench-secret")
+        os.environ.setdefault("METRICS_TOKEN", "bench-metrics")
+        # Every virtual user shares one address and the writes run flat out;
+        # measure the handlers rather than the admission limits.
+        os.environ.setdefault("ADMISSION_RESPONSES_RATE", "0")
+        os.environ.setdefault("ADMISSION_PROGRESS_RATE", "0")
+        os.environ.setdefault("ADMISSION_WRITE_LIMIT", "1000")
+
+        from app.database import get_engine
+        from app.migrations import migrate
+
+        from .run import run as run_bench
+        from .seed import seed as seed_database
+
+        _ = migrate()
+        sizes = seed_database(get_engine(), guests=guests, progress=progress, seed=seed)
+        typer.echo(
+            f"Seeded {sizes['guests']} guests, {sizes['responses']} responses,"
+            f" {sizes['progress']} progress events"
+        )
+
+        results = asyncio.run(
+            run_bench(users, requests, cold, only or None, seed, sizes)
+        )
+
+    report = {
+        "meta": {
+            "time": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "revision": git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "users": users,
+            "requests": requests,
+            "cold": cold,
+            "seed": seed,
+            "seeded": sizes,
+        },
+        "results": results,
+    }
+    if save is not None:
+        save.parent.mkdir(parents=True, exist_ok=True)
+        _ = save.write_text(json.dumps(report, indent=2) + "\n")
+        typer.echo(f"Saved results to {save}")
+
+
+@cli.command()
+def compare(
+    baseline: Path,
+    current: Path,
+    threshold: float = typer.Option(10.0, help="Regression threshold in percent"),
+):
+    """Compare two saved runs; exits 1 if any endpoint regressed past the threshold"""
+
+    before_report = json.loads(baseline.read_text())
+    after_report = json.loads(current.read_text())
+    before, after = before_report["results"], after_report["results"]
+
+    for key in ("users", "requests", "cold", "seeded", "cpus"):
+        if before_report["meta"].get(key) != after_report["meta"].get(key):
+            typer.echo(
+                f"Warning: runs differ in {key}: {before_report['meta'].get(key)}"
+                f" vs {after_report['meta'].get(key)}"
+            )
+
+    regressions: list[str] = []
+    typer.echo(f"{'endpoint':20} {'req/s':>20} {'p95 ms':>22} {'p99 ms':>22}")
+    for name in sorted(before.keys() & after.keys()):
+        old, new = before[name], after[name]
+        cells: list[str] = []
+        for key, higher_is_better in (
+            ("throughput", True),
+            ("p95_ms", False),
+            ("p99_ms", False),
+        ):
+            change = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+            worse = -change if higher_is_better else change
+            if worse > threshold:
+                regressions.append(f"{name} {key} {change:+.1f}%")
+            cells.append(f"{old[key]:8.1f} → {new[key]:8.1f} {change:+6.1f}%")
+        typer.echo(f"{name:20} " + "  ".join(cells))
+
+    for name in sorted(before.keys() ^ after.keys()):
+        typer.echo(f"{name:20} only in {'baseline' if name in before else 'current'}")
+
+    if regressions:
+        typer.echo("Regressions: " + ", ".join(regressions))
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    cli()
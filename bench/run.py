@@ -0,0 +1,253 @@
+"""run.py - drive the app in-process with concurrent virtual users"""
+
+import asyncio
+import itertools
+import os
+import random
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Any
+
+import httpx
+
+from .seed import BENCH_PASSWORD, BENCH_USER, HEADLINES
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    path: Callable[[random.Random], str]
+    body: Callable[[random.Random], Any] | None = None
+    auth: bool = False
+    # Fraction of the run's request count this scenario gets; heavy ones get less
+    share: float = 1.0
+    cacheable: bool = False
+    headers: dict[str, str] = field(default_factory=dict)
+
+
+def fixed(path: str) -> Callable[[random.Random], str]:
+    return lambda _: path
+
+
+def scenarios(guests: int, responses: int) -> list[Scenario]:
+    headlines = [headline for headline, _ in HEADLINES]
+    return [
+        Scenario("guests.list", "GET", fixed("/guests/"), auth=True, cacheable=True),
+        Scenario(
+            "guests.page",
+            "GET",
+            fixed("/guests/?limit=50&fields=guest_id,name,rsvp"),
+            auth=True,
+            cacheable=True,
+        ),
+        Scenario(
+            "guests.get",
+            "GET",
+            lambda rng: f"/guests/{rng.randint(1, guests)}",
+            auth=True,
+        ),
+        Scenario(
+            "guests.summary",
+            "GET",
+            fixed("/guests/summary"),
+            auth=True,
+            cacheable=True,
+        ),
+        Scenario(
+            "guests.export", "GET", fixed("/guests/export"), auth=True, share=0.1
+        ),
+        Scenario(
+            "guests.link",
+            "POST",
+            fixed("/guests/link/"),
+            body=lambda rng: [
+                {
+                    "guest_id": rng.randint(1, guests),
+                    "response_id": rng.randint(1, responses),
+                }
+                for _ in range(5)
+            ],
+            auth=True,
+        ),
+        Scenario(
+            "responses.list", "GET", fixed("/responses/"), auth=True, cacheable=True
+        ),
+        Scenario(
+            "responses.get",
+            "GET",
+            lambda rng: f"/responses/{rng.randint(1, responses)}",
+            auth=True,
+        ),
+        Scenario(
+            "responses.create",
+            "POST",
+            fixed("/responses/"),
+            body=lambda rng: {
+                "name": f"Guest {rng.randint(1, guests // 2)}-0",
+                "diet": None,
+                "rsvp": True,
+            },
+        ),
+        Scenario(
+            "progress.page",
+            "GET",
+            fixed("/progress/?limit=100"),
+            cacheable=True,
+        ),
+        Scenario("progress.avg", "GET", fixed("/progress/avg/"), cacheable=True),
+        Scenario(
+            "progress.count",
+            "GET",
+            fixed("/progress/count/"),
+            auth=True,
+            cacheable=True,
+        ),
+        Scenario("progress.stats", "GET", fixed("/progress/stats/"), cacheable=True),
+        Scenario(
+            "progress.quantiles", "GET", fixed("/progress/quantiles/"), auth=True
+        ),
+        Scenario(
+            "progress.histogram",
+            "GET",
+            fixed("/progress/histogram/?resolution=hour"),
+            auth=True,
+        ),
+        Scenario(
+            "progress.create",
+            "POST",
+            fixed("/progress/"),
+            body=lambda rng: {
+                "headline": rng.choice(headlines),
+                "timestamp": rng.randint(100, 300_000),
+            },
+        ),
+        Scenario(
+            "auth.login",
+            "POST",
+            fixed("/auth/login/"),
+            body=lambda _: {"username": BENCH_USER, "password": BENCH_PASSWORD},
+            share=0.05,
+        ),
+        Scenario(
+            "metrics",
+            "GET",
+            fixed("/metrics"),
+            share=0.2,
+            headers={"Authorization": f"Bearer {os.environ['METRICS_TOKEN']}"},
+        ),
+    ]
+
+
+@dataclass
+class Result:
+    latencies: list[float] = field(default_factory=list)
+    errors: int = 0
+    elapsed: float = 0.0
+
+    def summary(self) -> dict[str, float]:
+        ordered = sorted(self.latencies)
+        count = len(ordered)
+        return {
+            "requests": count,
+            "errors": self.errors,
+            "throughput": count / self.elapsed if self.elapsed else 0.0,
+            "mean_ms": sum(ordered) / count * 1000 if count else 0.0,
+            "p50_ms": percentile(ordered, 0.50) * 1000,
+            "p95_ms": percentile(ordered, 0.95) * 1000,
+            "p99_ms": percentile(ordered, 0.99) * 1000,
+        }
+
+
+def percentile(ordered: list[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+
+    if not ordered:
+        return 0.0
+    return ordered[max(0, min(len(ordered) - 1, round(q * len(ordered)) - 1))]
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    scenario: Scenario,
+    users: int,
+    requests: int,
+    token: str,
+    cold: bool,
+    seed: int,
+) -> Result:
+    result = Result()
+    total = max(users, int(requests * scenario.share))
+    issued = itertools.count()
+    headers = dict(scenario.headers)
+    if scenario.auth:
+        headers["Authorization"] = f"Bearer {token}"
+
+    async def user(rng: random.Random) -> None:
+        while (n := next(issued)) < total:
+            path = scenario.path(rng)
+            if cold and scenario.cacheable:
+                # A unique query string misses the per-version response cache
+                path += ("&" if "?" in path else "?") + f"_bench={n}"
+            body = scenario.body(rng) if scenario.body else None
+
+            start = time.perf_counter()
+            response = await client.request(
+                scenario.method, path, json=body, headers=headers
+            )
+            _ = await response.aread()
+            result.latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                result.errors += 1
+
+    start = time.perf_counter()
+    _ = await asyncio.gather(
+        *(user(random.Random(seed * 1000 + i)) for i in range(users))
+    )
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+async def run(
+    users: int,
+    requests: int,
+    cold: bool,
+    only: list[str] | None,
+    seed: int,
+    sizes: dict[str, int],
+) -> dict[str, dict[str, float]]:
+    from app.main import app
+
+    results: dict[str, dict[str, float]] = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench", timeout=None
+        ) as client:
+            login = await client.post(
+                "/auth/login/",
+                json={"username": BENCH_USER, "password": BENCH_PASSWORD},
+            )
+            login.raise_for_status()
+            token: str = login.json()["access_token"]
+
+            for scenario in scenarios(sizes["guests"], sizes["responses"]):
+                if only and not any(scenario.name.startswith(name) for name in only):
+                    continue
+                result = await run_scenario(
+                    client, scenario, users, requests, token, cold, seed
+                )
+                results[scenario.name] = result.summary()
+                print_summary(scenario.name, results[scenario.name])
+
+    return results
+
+
+def print_summary(name: str, summary: dict[str, float]) -> None:
+    print(
+        f"{name:20} {summary['throughput']:9.1f} req/s"
+        f"  p50 {summary['p50_ms']:8.2f}  p95 {summary['p95_ms']:8.2f}"
+        f"  p99 {summary['p99_ms']:8.2f} ms  errors {summary['errors']:.0f}",
+        flush=True,
+    )
@@ -0,0 +1,116 @@
+"""seed.py - fill an empty database with realistic, reproducible volumes"""
+
+import datetime
+import random
+
+from sqlalchemy import Engine, insert
+from sqlmodel import Session
+
+from app.passwords import get_password_hash
+from app.rollup import rebuild_group_counts
+from app.routers.auth import User
+from app.routers.guests import Guest
+from app.routers.progress import Progress
+from app.routers.responses import Response, normalize_name
+
+BENCH_USER = "bench"
+BENCH_PASSWORD = "bench-password"
+DAY_MS = 86_400_000
+
+# Funnel steps in the order a visitor reaches them, with typical elapsed ms
+HEADLINES = [
+    ("landing", 500),
+    ("schedule", 8_000),
+    ("venue", 15_000),
+    ("accommodation", 25_000),
+    ("faq", 40_000),
+    ("rsvp_open", 60_000),
+    ("rsvp_name", 75_000),
+    ("rsvp_diet", 90_000),
+    ("rsvp_submit", 110_000),
+    ("gifts", 150_000),
+    ("photos", 200_000),
+    ("contact", 240_000),
+]
+
+
+def seed(
+    engine: Engine,
+    guests: int = 500,
+    progress: int = 100_000,
+    response_rate: float = 0.6,
+    seed: int = 1234,
+) -> dict[str, int]:
+    """Insert guests in households, RSVPs for some households and progress events"""
+
+    rng = random.Random(seed)
+    now = datetime.datetime(2025, 6, 1, 12, 0)
+    received = int(now.timestamp() * 1000)
+
+    guest_rows: list[dict[str, object]] = []
+    response_rows: list[dict[str, object]] = []
+    household = 0
+    while len(guest_rows) < guests:
+        household += 1
+        group = f"Household {household}"
+        size = min(rng.choice((1, 2, 2, 2, 3, 4)), guests - len(guest_rows))
+        responded = rng.random() < response_rate
+        for member in range(size):
+            name = f"Guest {household}-{member}"
+            response_id = None
+            if responded:
+                response_rows.append(
+                    {
+                        "response_id": len(response_rows) + 1,
+                        "name": name,
+                        "diet": rng.choice((None, None, "vegan", "gluten free")),
+                        "rsvp": rng.random() < 0.85,
+                        "time": now - datetime.timedelta(minutes=rng.randint(0, 60_000)),
+                        "active": True,
+                    }
+                )
+                response_id = len(response_rows)
+            guest_rows.append(
+                {
+                    "name": name,
+                    "group": group,
+                    "active": True,
+                    "name_key": normalize_name(name),
+                    "response_id": response_id,
+                }
+            )
+
+    progress_rows = [
+        {
+            "headline": headline,
+            "timestamp": int(rng.lognormvariate(0, 0.5) * typical),
+            "received": received - rng.randrange(DAY_MS),
+        }
+        for headline, typical in rng.choices(
+            HEADLINES, weights=range(len(HEADLINES), 0, -1), k=progress
+        )
+    ]
+
+    with engine.begin() as connection:
+        _ = connection.execute(insert(Response), response_rows)
+        _ = connection.execute(insert(Guest), guest_rows)
+        _ = connection.execute(insert(Progress), progress_rows)
+        _ = connection.execute(
+            insert(User),
+            [
+                {
+                    "username": BENCH_USER,
+                    "hashed_password": get_password_hash(BENCH_PASSWORD),
+                    "disabled": False,
+                }
+            ],
+        )
+    with Session(engine) as session:
+        rebuild_group_counts(session)
+        session.commit()
+
+    return {
+        "guests": len(guest_rows),
+        "responses": len(response_rows),
+        "progress": len(progress_rows),
+    }
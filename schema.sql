@@ -1,10 +1,87 @@
-drop table if exists responses;
+-- Generated by `python -m app.cli schema`; the migrations in app/migrations.py
+-- are the source of truth.
 
-create table responses (
-  id INTEGER PRIMARY KEY,
-  name TEXT NOT NULL,
-  diet TEXT,
-  rsvp BOOLEAN DEFAULT True,
-  time TEXT NOT NULL DEFAULT current_timestamp,
-  active BOOLEAN DEFAULT True
+CREATE TABLE guestgroupcount (
+	"group" VARCHAR NOT NULL,
+	stat VARCHAR NOT NULL,
+	amount INTEGER NOT NULL,
+	PRIMARY KEY ("group", stat)
 );
+
+CREATE TABLE idempotencykey (
+	"key" VARCHAR NOT NULL,
+	fingerprint VARCHAR NOT NULL,
+	status_code INTEGER NOT NULL,
+	body VARCHAR NOT NULL,
+	created INTEGER NOT NULL,
+	PRIMARY KEY ("key")
+);
+
+CREATE INDEX ix_idempotencykey_created ON idempotencykey (created);
+
+CREATE TABLE progress (
+	timestamp INTEGER NOT NULL,
+	headline VARCHAR NOT NULL,
+	progress_id INTEGER NOT NULL,
+	received INTEGER,
+	PRIMARY KEY (progress_id)
+);
+
+CREATE INDEX ix_progress_headline_timestamp ON progress (headline, timestamp);
+
+CREATE TABLE progressaggregate (
+	headline VARCHAR NOT NULL,
+	amount INTEGER NOT NULL,
+	total INTEGER NOT NULL,
+	first_timestamp INTEGER NOT NULL,
+	last_timestamp INTEGER NOT NULL,
+	PRIMARY KEY (headline)
+);
+
+CREATE TABLE progresslogsegment (
+	name VARCHAR NOT NULL,
+	PRIMARY KEY (name)
+);
+
+CREATE TABLE response (
+	name VARCHAR NOT NULL,
+	diet VARCHAR,
+	rsvp BOOLEAN NOT NULL,
+	response_id INTEGER NOT NULL,
+	time DATETIME NOT NULL,
+	active BOOLEAN NOT NULL,
+	PRIMARY KEY (response_id)
+);
+
+CREATE INDEX ix_response_active ON response (active);
+
+CREATE INDEX ix_response_name ON response (name);
+
+CREATE TABLE user (
+	username VARCHAR NOT NULL,
+	user_id INTEGER NOT NULL,
+	hashed_password VARCHAR NOT NULL,
+	disabled BOOLEAN NOT NULL,
+	PRIMARY KEY (user_id)
+);
+
+CREATE INDEX ix_user_username ON user (username);
+
+CREATE TABLE guest (
+	name VARCHAR NOT NULL,
+	"group" VARCHAR NOT NULL,
+	guest_id INTEGER NOT NULL,
+	response_id INTEGER,
+	active BOOLEAN,
+	name_key VARCHAR,
+	PRIMARY KEY (guest_id),
+	FOREIGN KEY(response_id) REFERENCES response (response_id)
+);
+
+CREATE INDEX ix_guest_group ON guest ("group");
+
+CREATE INDEX ix_guest_name ON guest (name);
+
+CREATE INDEX ix_guest_name_key ON guest (name_key);
+
+CREATE INDEX ix_guest_response_id ON guest (response_id);